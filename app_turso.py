@@ -1,18 +1,23 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import libsql
 import re
 import os
+import functools
 import time
 import logging
 import random
 import base64
 import hmac
 import io
+import types
 import unicodedata
 import html as _esc_html
 import calendar as _cal_mod
 from difflib import get_close_matches as _gcm
+from operator import itemgetter
+from itertools import chain, islice
 import plotly.graph_objects as go
 from datetime import datetime, timedelta, date, timezone
 from PIL import Image
@@ -101,16 +106,31 @@ def _senha_confere(digitada: str, esperada: str) -> bool:
 
 
 # ── Weather Widget ───────────────────────────────────────────────────────────
-def _weather_desc_from_code(code):
-    if code == 0:              return "☀️", "Céu limpo"
-    elif code in (1, 2):       return "🌤️", "Poucas nuvens"
-    elif code == 3:            return "☁️", "Nublado"
-    elif code in (45, 48):     return "🌫️", "Névoa"
-    elif code in (51,53,55):   return "🌦️", "Chuvisco"
-    elif code in (61,63,65):   return "🌧️", "Chuva"
-    elif code in (80,81,82):   return "🌧️", "Pancadas"
-    elif code in (95,96,99):   return "⛈️", "Tempestade"
-    else:                      return "🌡️", ""
+# weathercode (Open-Meteo) → (emoji, descrição)
+_WCODE_DESC = {
+    0: ("☀️", "Céu limpo"),
+    1: ("🌤️", "Poucas nuvens"), 2: ("🌤️", "Poucas nuvens"),
+    3: ("☁️", "Nublado"),
+    45: ("🌫️", "Névoa"), 48: ("🌫️", "Névoa"),
+    51: ("🌦️", "Chuvisco"), 53: ("🌦️", "Chuvisco"), 55: ("🌦️", "Chuvisco"),
+    61: ("🌧️", "Chuva"), 63: ("🌧️", "Chuva"), 65: ("🌧️", "Chuva"),
+    80: ("🌧️", "Pancadas"), 81: ("🌧️", "Pancadas"), 82: ("🌧️", "Pancadas"),
+    95: ("⛈️", "Tempestade"), 96: ("⛈️", "Tempestade"), 99: ("⛈️", "Tempestade"),
+}
+_WCODE_DESC_DEFAULT = ("🌡️", "")
+
+
+# weatherCode do wttr → Open-Meteo aproximado (fora da tabela: 2, poucas nuvens)
+_WTTR_TO_WCODE = {
+    113: 0,
+    116: 1,
+    119: 3, 122: 3,
+    143: 45, 248: 45, 260: 45,
+    176: 61, 263: 61, 266: 61, 293: 61, 296: 61,
+    299: 63, 302: 63, 305: 63, 308: 63,
+    353: 80, 356: 80, 359: 80,
+    200: 95, 386: 95, 389: 95, 392: 95, 395: 95,
+}
 
 
 def _get_weather_quirinopolis_wttr():
@@ -123,18 +143,7 @@ def _get_weather_quirinopolis_wttr():
     temp = round(float(cur["temp_C"]))
     humid = int(cur["humidity"])
     vento = round(float(cur["windspeedKmph"]))
-    # mapeia weatherCode do wttr → Open-Meteo aproximado
-    wc = int(cur["weatherCode"])
-    if wc == 113:   code = 0
-    elif wc in (116,):      code = 1
-    elif wc in (119,122):   code = 3
-    elif wc in (143,248,260): code = 45
-    elif wc in (176,263,266,293,296): code = 61
-    elif wc in (299,302,305,308):     code = 63
-    elif wc in (353,356,359):         code = 80
-    elif wc in (200,386,389,392,395): code = 95
-    else:                   code = 2
-    emoji, desc = _weather_desc_from_code(code)
+    code = _WTTR_TO_WCODE.get(int(cur["weatherCode"]), 2)
     today = d["weather"][0]
     min_t = round(float(today["mintempC"]))
     max_t = round(float(today["maxtempC"]))
@@ -158,36 +167,6 @@ def _get_weather_quirinopolis_wttr():
     }
 
 
-@st.cache_data(ttl=1800)
-def get_weather_quirinopolis():
-    import urllib.request, json
-    # Tenta Open-Meteo primeiro
-    try:
-        url = (
-            "https://api.open-meteo.com/v1/forecast"
-            "?latitude=-18.45&longitude=-50.45"
-            "&current=temperature_2m,weathercode"
-            "&timezone=America%2FSao_Paulo"
-        )
-        with urllib.request.urlopen(url, timeout=4) as r:
-            data = json.loads(r.read())
-        temp = round(data["current"]["temperature_2m"])
-        code = data["current"]["weathercode"]
-        emoji, desc = _weather_desc_from_code(code)
-        return temp, emoji, desc
-    except Exception:
-        pass
-    # Reserva: wttr.in
-    try:
-        wd = _get_weather_quirinopolis_wttr()
-        cur = wd["current"]
-        temp = round(cur["temperature_2m"])
-        emoji, desc = _weather_desc_from_code(int(cur["weathercode"]))
-        return temp, emoji, desc
-    except Exception:
-        return None, "🌡️", ""
-
-
 @st.cache_data(ttl=1800)
 def get_weather_forecast_quirinopolis():
     """Retorna previsão completa de 6 dias para Quirinópolis."""
@@ -228,8 +207,9 @@ if "admin_unlocked" not in st.session_state:
 if "_upload_success_msg" not in st.session_state:
     st.session_state["_upload_success_msg"] = None
 
-# ── Weather gradient helper (usada na tela de login e no dashboard) ───────────
-def _wcode_bg_gradient(code, alpha=1.0):
+# ── Weather gradient helper (card de clima da tela de login) ──────────────────
+def _wcode_bg_gradient(code):
+    """Gradiente de fundo por weathercode — chamado só no import, para _WCODE_LOGIN_VISUAL."""
     if code is None:
         r = "30,60,114"; g = "42,82,152"
     elif int(code) == 0:
@@ -248,105 +228,165 @@ def _wcode_bg_gradient(code, alpha=1.0):
         r = "44,62,80"; g = "107,143,166"
     else:
         r = "30,60,114"; g = "42,82,152"
-    if alpha < 1.0:
-        return f"linear-gradient(160deg,rgba({r},{alpha}) 0%,rgba({g},{alpha}) 100%)"
     return f"linear-gradient(160deg,rgb({r}) 0%,rgb({g}) 100%)"
 
+def _wcode_icon_html(code):
+    """Monta o ícone animado (CSS) do clima da tela de login para um weathercode.
+
+    Tamanho/sombra vêm das classes .wx-ico/.wx-sombra do <style> do login;
+    o inline carrega só a animação.
+    """
+    code = int(code) if code is not None else -1
+    if code == 0:
+        return '<div class="wx-ico wx-sombra" style="animation:sunSpin 20s linear infinite;">☀️</div>'
+    elif code in (1, 2):
+        return (
+            '<div class="wx-sombra" style="position:relative;display:inline-block;'
+            'width:5.4rem;height:4.8rem;margin-bottom:10px;">'
+            '<div style="position:absolute;top:0;left:0;font-size:3.8rem;'
+            'animation:sunSpin 20s linear infinite;display:inline-block;">☀️</div>'
+            '<div style="position:absolute;bottom:0;right:-4px;font-size:3.2rem;'
+            'animation:cloudDrift 4s ease-in-out infinite;display:inline-block;">☁️</div>'
+            '</div>'
+        )
+    elif code == 3:
+        return '<div class="wx-ico wx-sombra" style="animation:cloudFloat 4s ease-in-out infinite;">☁️</div>'
+    elif code in (45, 48):
+        return '<div class="wx-ico wx-sombra" style="animation:cloudFloat 6s ease-in-out infinite;">🌫️</div>'
+    elif code in (51, 53, 55, 61, 63, 65, 80, 81, 82):
+        em = "🌦️" if code in (51, 53, 55) else "🌧️"
+        return f'<div class="wx-ico wx-sombra" style="animation:cloudFloat 3.5s ease-in-out infinite;">{em}</div>'
+    elif code in (95, 96, 99):
+        return '<div class="wx-ico" style="animation:stormFlash 1.2s ease-in-out infinite;">⛈️</div>'
+    elif code in (71, 73, 75, 77):
+        return '<div class="wx-ico wx-sombra" style="animation:snowSpin 4s ease-in-out infinite;">❄️</div>'
+    else:
+        return '<div class="wx-ico wx-sombra">🌡️</div>'
+
+# Só existem ~20 weathercodes: o (gradiente de fundo, HTML do ícone) de cada
+# um é montado uma vez no import
+_WCODES = (0, 1, 2, 3, 45, 48, 51, 53, 55, 61, 63, 65, 80, 81, 82, 95, 96, 99, 71, 73, 75, 77)
+_WCODE_LOGIN_VISUAL = {c: (_wcode_bg_gradient(c), _wcode_icon_html(c)) for c in _WCODES}
+_WCODE_LOGIN_VISUAL_DEFAULT = (_wcode_bg_gradient(None), _wcode_icon_html(None))
+
+# CSS estático da tela de login (inclui keyframes e classes do card de clima)
+_LOGIN_CSS = """
+<style>
+@import url('https://fonts.googleapis.com/css2?family=Outfit:wght@300;500;700;900&display=swap');
+.stApp {
+    background: linear-gradient(160deg,rgba(10,15,26,0.32) 0%,rgba(10,15,26,0.24) 100%);
+    font-family:'Outfit',sans-serif;
+}
+#MainMenu,footer,header{visibility:hidden;}
+.block-container{padding:1.5rem 1rem !important;max-width:100% !important;}
+.stTextInput>div>div>input{
+    background:rgba(255,255,255,0.1) !important;
+    border:1px solid rgba(255,255,255,0.22) !important;
+    border-radius:30px !important;
+    color:black !important;
+    padding:12px 20px !important;
+    font-size:1rem !important;
+    text-align:center;
+    font-family:'Outfit',sans-serif !important;
+    letter-spacing:1px;
+}
+.stTextInput>div>div>input::placeholder{color:rgba(255,255,255,0.4) !important;}
+.stTextInput label{display:none !important;}
+.stForm{border:none !important;padding:0 !important;}
+.stFormSubmitButton>button{
+    background:rgba(255,255,255,0.12) !important;
+    border:1px solid rgba(255,255,255,0.28) !important;
+    border-radius:30px !important;
+    color:white !important;
+    font-size:0.95rem !important;
+    font-weight:600 !important;
+    letter-spacing:1.5px !important;
+    padding:10px !important;
+    font-family:'Outfit',sans-serif !important;
+    transition:background .2s !important;
+    width:100%;
+}
+.stFormSubmitButton>button:hover{background:rgba(255,255,255,0.22) !important;}
+@media(max-width:640px){.block-container{padding:0.8rem 0.5rem !important;}}
+@keyframes sunSpin {
+    from { transform: rotate(0deg); }
+    to   { transform: rotate(360deg); }
+}
+@keyframes cloudDrift {
+    0%   { transform: translateX(-6px); }
+    50%  { transform: translateX(6px); }
+    100% { transform: translateX(-6px); }
+}
+@keyframes cloudFloat {
+    0%   { transform: translateY(0px); }
+    50%  { transform: translateY(-5px); }
+    100% { transform: translateY(0px); }
+}
+@keyframes stormFlash {
+    0%,100% { filter: drop-shadow(0 6px 16px rgba(255,255,255,0.25)); }
+    50%     { filter: drop-shadow(0 0 24px rgba(255,220,50,0.9)); }
+}
+@keyframes snowSpin {
+    0%   { transform: rotate(0deg) translateY(0px); }
+    50%  { transform: rotate(180deg) translateY(-4px); }
+    100% { transform: rotate(360deg) translateY(0px); }
+}
+.wx-ico{font-size:5rem;line-height:1;margin-bottom:10px;display:inline-block;}
+.wx-sombra{filter:drop-shadow(0 6px 16px rgba(255,255,255,0.25));}
+.wx-dia{flex:1;background:rgba(0,0,0,0.18);border-radius:14px;padding:9px 2px;
+        text-align:center;border:1px solid rgba(255,255,255,0.06);}
+.wx-dia.hoje{background:rgba(255,255,255,0.18);border:1px solid rgba(255,255,255,0.28);}
+.wx-dia-nome{font-size:0.55rem;color:rgba(255,255,255,0.6);margin-bottom:4px;font-weight:400;
+             text-transform:uppercase;letter-spacing:0.3px;}
+.wx-dia.hoje .wx-dia-nome{font-weight:700;}
+.wx-dia-ico{font-size:1.1rem;margin:3px 0;filter:drop-shadow(0 2px 6px rgba(255,255,255,0.2));}
+.wx-dia-max{font-size:0.78rem;font-weight:700;color:#fff;margin-top:2px;}
+.wx-dia-min{font-size:0.58rem;color:rgba(255,255,255,0.4);}
+@media (prefers-reduced-motion: reduce){
+    .wx-ico,.wx-sombra *{animation:none !important;}
+}
+</style>
+"""
+
 # ── Login Screen ─────────────────────────────────────────────────────────────
 if not st.session_state.authenticated:
     _DIAS_PT_FULL = ["Segunda", "Terça", "Quarta", "Quinta", "Sexta", "Sábado", "Domingo"]
     _DIAS_PT      = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
 
+    # Como _WCODE_DESC, mas a tela de login também tem ícone para neve
+    _WCODE_EMOJI_LOGIN = {c: em for c, (em, _) in _WCODE_DESC.items()}
+    _WCODE_EMOJI_LOGIN.update(dict.fromkeys((71, 73, 75, 77), "❄️"))
+
     def _wcode_emoji_login(code):
         if code is None: return "🌡️"
-        code = int(code)
-        if code == 0:               return "☀️"
-        elif code in (1, 2):        return "🌤️"
-        elif code == 3:             return "☁️"
-        elif code in (45, 48):      return "🌫️"
-        elif code in (51,53,55):    return "🌦️"
-        elif code in (61,63,65,80,81,82): return "🌧️"
-        elif code in (95,96,99):    return "⛈️"
-        elif code in (71,73,75,77): return "❄️"
-        else:                       return "🌡️"
-
-    def _wcode_desc_login(code):
-        if code is None: return ""
-        code = int(code)
-        if code == 0:               return "Céu limpo"
-        elif code in (1, 2):        return "Poucas nuvens"
-        elif code == 3:             return "Nublado"
-        elif code in (45, 48):      return "Névoa"
-        elif code in (51,53,55):    return "Chuvisco"
-        elif code in (61,63,65):    return "Chuva"
-        elif code in (80,81,82):    return "Pancadas"
-        elif code in (95,96,99):    return "Tempestade"
-        else:                       return ""
-
-
-    st.markdown("""
-    <style>
-    @import url('https://fonts.googleapis.com/css2?family=Outfit:wght@300;500;700;900&display=swap');
-    .stApp {
-        background: linear-gradient(160deg,rgba(10,15,26,0.32) 0%,rgba(10,15,26,0.24) 100%);
-        font-family:'Outfit',sans-serif;
-    }
-    #MainMenu,footer,header{visibility:hidden;}
-    .block-container{padding:1.5rem 1rem !important;max-width:100% !important;}
-    .stTextInput>div>div>input{
-        background:rgba(255,255,255,0.1) !important;
-        border:1px solid rgba(255,255,255,0.22) !important;
-        border-radius:30px !important;
-        color:black !important;
-        padding:12px 20px !important;
-        font-size:1rem !important;
-        text-align:center;
-        font-family:'Outfit',sans-serif !important;
-        letter-spacing:1px;
-    }
-    .stTextInput>div>div>input::placeholder{color:rgba(255,255,255,0.4) !important;}
-    .stTextInput label{display:none !important;}
-    .stForm{border:none !important;padding:0 !important;}
-    .stFormSubmitButton>button{
-        background:rgba(255,255,255,0.12) !important;
-        border:1px solid rgba(255,255,255,0.28) !important;
-        border-radius:30px !important;
-        color:white !important;
-        font-size:0.95rem !important;
-        font-weight:600 !important;
-        letter-spacing:1.5px !important;
-        padding:10px !important;
-        font-family:'Outfit',sans-serif !important;
-        transition:background .2s !important;
-        width:100%;
-    }
-    .stFormSubmitButton>button:hover{background:rgba(255,255,255,0.22) !important;}
-    @media(max-width:640px){.block-container{padding:0.8rem 0.5rem !important;}}
-    @keyframes sunSpin {
-        from { transform: rotate(0deg); }
-        to   { transform: rotate(360deg); }
-    }
-    @keyframes cloudDrift {
-        0%   { transform: translateX(-6px); }
-        50%  { transform: translateX(6px); }
-        100% { transform: translateX(-6px); }
-    }
-    @keyframes cloudFloat {
-        0%   { transform: translateY(0px); }
-        50%  { transform: translateY(-5px); }
-        100% { transform: translateY(0px); }
-    }
-    @keyframes stormFlash {
-        0%,100% { filter: drop-shadow(0 6px 16px rgba(255,255,255,0.25)); }
-        50%     { filter: drop-shadow(0 0 24px rgba(255,220,50,0.9)); }
-    }
-    @keyframes snowSpin {
-        0%   { transform: rotate(0deg) translateY(0px); }
-        50%  { transform: rotate(180deg) translateY(-4px); }
-        100% { transform: rotate(360deg) translateY(0px); }
-    }
-    </style>
-    """, unsafe_allow_html=True)
+        return _WCODE_EMOJI_LOGIN.get(int(code), "🌡️")
+
+    # Estilo dos cards fica nas classes .wx-dia* do <style> do login
+    _DIA_CARD_TMPL = (
+        '<div class="wx-dia%s">'
+        '<div class="wx-dia-nome">%s</div>'
+        '<div class="wx-dia-ico">%s</div>'
+        '<div class="wx-dia-max">%d°</div>'
+        '<div class="wx-dia-min">%d°</div>'
+        '</div>'
+    )
+
+    @st.cache_data(ttl=1800)
+    def _html_previsao_dias(daily: dict) -> str:
+        """Cards dos 6 dias da previsão — só mudam quando a previsão (cacheada) muda."""
+        strptime = datetime.strptime
+        dias = zip(
+            daily["time"][:6], daily["weathercode"][:6],
+            daily["temperature_2m_max"][:6], daily["temperature_2m_min"][:6],
+        )
+        return "".join([
+            _DIA_CARD_TMPL % (
+                " hoje" if i == 0 else "",
+                "Hoje" if i == 0 else _DIAS_PT[strptime(dia, "%Y-%m-%d").weekday()],
+                _wcode_emoji_login(wcode), round(tmax), round(tmin),
+            )
+            for i, (dia, wcode, tmax, tmin) in enumerate(dias)
+        ])
 
     wd = get_weather_forecast_quirinopolis()
     _now = datetime.now(tz=timezone(timedelta(hours=-3)))
@@ -362,8 +402,7 @@ if not st.session_state.authenticated:
         wcode_cur = int(cur["weathercode"])
         humid     = round(cur.get("relative_humidity_2m", 0))
         vento     = round(cur.get("wind_speed_10m", 0))
-        emoji_cur = _wcode_emoji_login(wcode_cur)
-        desc_cur  = _wcode_desc_login(wcode_cur)
+        desc_cur  = _WCODE_DESC.get(wcode_cur, _WCODE_DESC_DEFAULT)[1]
 
         sunrise_raw = daily["sunrise"][0]
         sunset_raw  = daily["sunset"][0]
@@ -379,86 +418,9 @@ if not st.session_state.authenticated:
 
         chuva_pct = int(daily["precipitation_probability_max"][0] or 0)
 
-        dias_cards_html = ""
-        for i in range(6):
-            date_str = daily["time"][i]
-            dt_d = datetime.strptime(date_str, "%Y-%m-%d")
-            nome_d = "Hoje" if i == 0 else _DIAS_PT[dt_d.weekday()]
-            em_d   = _wcode_emoji_login(daily["weathercode"][i])
-            tmax   = round(daily["temperature_2m_max"][i])
-            tmin   = round(daily["temperature_2m_min"][i])
-            bg_d   = "rgba(255,255,255,0.18)" if i == 0 else "rgba(0,0,0,0.18)"
-            bd_d   = "border:1px solid rgba(255,255,255,0.28);" if i == 0 else "border:1px solid rgba(255,255,255,0.06);"
-            fw_d   = "700" if i == 0 else "400"
-            dias_cards_html += (
-                f'<div style="flex:1;background:{bg_d};border-radius:14px;padding:9px 2px;'
-                f'text-align:center;{bd_d}">'
-                f'<div style="font-size:0.55rem;color:rgba(255,255,255,0.6);'
-                f'margin-bottom:4px;font-weight:{fw_d};text-transform:uppercase;letter-spacing:0.3px;">{nome_d}</div>'
-                f'<div style="font-size:1.1rem;margin:3px 0;'
-                f'filter:drop-shadow(0 2px 6px rgba(255,255,255,0.2));">{em_d}</div>'
-                f'<div style="font-size:0.78rem;font-weight:700;color:#fff;margin-top:2px;">{tmax}°</div>'
-                f'<div style="font-size:0.58rem;color:rgba(255,255,255,0.4);">{tmin}°</div>'
-                f'</div>'
-            )
-
-        def _wcode_animated_icon(code):
-            shadow = "filter:drop-shadow(0 6px 16px rgba(255,255,255,0.25));"
-            code = int(code) if code is not None else -1
-            if code == 0:
-                return (
-                    f'<div style="font-size:5rem;line-height:1;margin-bottom:10px;'
-                    f'{shadow}display:inline-block;'
-                    f'animation:sunSpin 20s linear infinite;">☀️</div>'
-                )
-            elif code in (1, 2):
-                return (
-                    f'<div style="position:relative;display:inline-block;'
-                    f'width:5.4rem;height:4.8rem;margin-bottom:10px;{shadow}">'
-                    f'<div style="position:absolute;top:0;left:0;font-size:3.8rem;'
-                    f'animation:sunSpin 20s linear infinite;display:inline-block;">☀️</div>'
-                    f'<div style="position:absolute;bottom:0;right:-4px;font-size:3.2rem;'
-                    f'animation:cloudDrift 4s ease-in-out infinite;display:inline-block;">☁️</div>'
-                    f'</div>'
-                )
-            elif code == 3:
-                return (
-                    f'<div style="font-size:5rem;line-height:1;margin-bottom:10px;'
-                    f'{shadow}display:inline-block;'
-                    f'animation:cloudFloat 4s ease-in-out infinite;">☁️</div>'
-                )
-            elif code in (45, 48):
-                return (
-                    f'<div style="font-size:5rem;line-height:1;margin-bottom:10px;'
-                    f'{shadow}display:inline-block;'
-                    f'animation:cloudFloat 6s ease-in-out infinite;">🌫️</div>'
-                )
-            elif code in (51, 53, 55, 61, 63, 65, 80, 81, 82):
-                em = "🌦️" if code in (51, 53, 55) else "🌧️"
-                return (
-                    f'<div style="font-size:5rem;line-height:1;margin-bottom:10px;'
-                    f'{shadow}display:inline-block;'
-                    f'animation:cloudFloat 3.5s ease-in-out infinite;">{em}</div>'
-                )
-            elif code in (95, 96, 99):
-                return (
-                    f'<div style="font-size:5rem;line-height:1;margin-bottom:10px;'
-                    f'display:inline-block;'
-                    f'animation:stormFlash 1.2s ease-in-out infinite;">⛈️</div>'
-                )
-            elif code in (71, 73, 75, 77):
-                return (
-                    f'<div style="font-size:5rem;line-height:1;margin-bottom:10px;'
-                    f'{shadow}display:inline-block;'
-                    f'animation:snowSpin 4s ease-in-out infinite;">❄️</div>'
-                )
-            else:
-                return (
-                    f'<div style="font-size:5rem;line-height:1;margin-bottom:10px;'
-                    f'{shadow}display:inline-block;">🌡️</div>'
-                )
+        dias_cards_html = _html_previsao_dias(daily)
 
-        _bg_grad = _wcode_bg_gradient(wcode_cur)
+        _bg_grad, _icon_html = _WCODE_LOGIN_VISUAL.get(wcode_cur, _WCODE_LOGIN_VISUAL_DEFAULT)
         card_weather = f"""
 <div style="
     background:{_bg_grad};
@@ -475,7 +437,7 @@ if not st.session_state.authenticated:
     {_dia_nome} &nbsp;·&nbsp; {_data_fmt} &nbsp;·&nbsp; {_hora}
   </div>
   <div style="text-align:center;padding:4px 0 18px;position:relative;">
-    {_wcode_animated_icon(wcode_cur)}
+    {_icon_html}
     <div style="font-size:4.2rem;font-weight:700;line-height:1;letter-spacing:-2px;
                 text-shadow:0 4px 24px rgba(0,0,0,0.3);">{temp_cur}°</div>
     <div style="font-size:1rem;font-weight:500;color:rgba(255,255,255,0.85);margin-top:10px;">{desc_cur}</div>
@@ -526,7 +488,8 @@ if not st.session_state.authenticated:
 
     _, col_login, _ = st.columns([1, 1.5, 1])
     with col_login:
-        st.markdown(card_weather, unsafe_allow_html=True)
+        # CSS da tela + card de clima numa única mensagem (o <style> vale para a página toda)
+        st.markdown(_LOGIN_CSS + card_weather, unsafe_allow_html=True)
         import iframe_compat as _stc_login
         _stc_login.html("""<script>
         (function(){
@@ -1386,6 +1349,8 @@ _RE_SPACES = re.compile(r"\s+")
 _RE_DIGITS = re.compile(r"\d+")
 _RE_ALPHA = re.compile(r"[a-zA-Z]")
 _RE_NON_ALNUM = re.compile(r"[^A-Z0-9]")
+# Células vazias depois de str(): None, NaN e string vazia
+_VALORES_VAZIOS = frozenset({"NAN", "NONE", ""})
 _RE_PA_SIZE = re.compile(
     r'\b\d+[\.,]?\d*\s*'
     r'(?:L|ML|KG|G|GR|SC|T|MG|WG|WP|SL|EC|CS|GD|OD|SE|FS|EW|ME|TG|WDG|ZC|DC|ULV)\b',
@@ -1469,15 +1434,24 @@ def _lookup_pa_from_index(nome: str, mapa: dict, cat_n: dict, cat_ns: dict,
 _BATCH_MAX_PARAMS = 900  # abaixo do limite legado SQLITE_MAX_VARIABLE_NUMBER=999
 
 
+# Colunas de estoque_mestre na ordem dos INSERTs; itemgetter tira a tupla do
+# record-dict num passo só (sem 8 lookups r["..."] escritos à mão por linha)
+_REC_ESTOQUE_COLS = ("codigo", "produto", "categoria", "qtd_sistema", "qtd_fisica", "diferenca", "nota", "status")
+_rec_estoque_tuple = itemgetter(*_REC_ESTOQUE_COLS)
+
+
 def _chunks(seq, size):
-    for i in range(0, len(seq), size):
-        yield seq[i:i + size]
+    """Fatia qualquer iterável (lista ou gerador) em listas de até size itens."""
+    it = iter(seq)
+    while chunk := list(islice(it, size)):
+        yield chunk
 
 
-def _insert_many(conn, table: str, cols: list, rows: list) -> None:
-    """INSERT multi-linha em chunks, substituindo executemany (1 round-trip/linha)."""
-    if not rows:
-        return
+def _insert_many(conn, table: str, cols: list, rows) -> None:
+    """INSERT multi-linha em chunks, substituindo executemany (1 round-trip/linha).
+
+    rows pode ser um gerador: só um chunk fica materializado por vez.
+    """
     ncols = len(cols)
     chunk_rows = max(1, _BATCH_MAX_PARAMS // ncols)
     col_sql = ", ".join(cols)
@@ -1528,6 +1502,21 @@ def _get_connection():
     else:
         conn = libsql.connect(LOCAL_DB_PATH)
 
+    # ── PRAGMAs da conexão (1x) ──
+    # cache/temp em memória valem para as leituras locais nos dois modos.
+    # journal_mode/synchronous só no banco puramente local: na embedded replica
+    # o arquivo é gerido pela replicação do libsql e as escritas vão ao primário.
+    # cache_size negativo = KiB: ~20 MB por conexão (o default é ~2 MB), sem
+    # disputar a RAM do container com os DataFrames do st.cache_data.
+    _pragmas = ["PRAGMA cache_size=-20000", "PRAGMA temp_store=MEMORY"]
+    if not _using_cloud:
+        _pragmas += ["PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL"]
+    for _p in _pragmas:
+        try:
+            conn.execute(_p)
+        except Exception as e:
+            logging.warning(f"{_p} falhou: {e}")
+
     # ── Criar tabelas (roda 1x, não a cada get_db()) ──
     conn.execute("""
         CREATE TABLE IF NOT EXISTS estoque_mestre (
@@ -5468,6 +5457,9 @@ _SHORT_PREFIXES = [
 ]
 
 
+# Chamadas por linha em parsers e treemap com os mesmos nomes repetidos
+# (~500 produtos distintos por planilha): cache transforma o trabalho em lookup.
+@functools.lru_cache(maxsize=8192)
 def classify_product(name: str) -> str:
     n = name.upper()
     for cat, keywords in _CLASSIFY_RULES:
@@ -5477,10 +5469,12 @@ def classify_product(name: str) -> str:
     return "OUTROS"
 
 
+@functools.lru_cache(maxsize=8192)
 def normalize_grupo(grupo: str) -> str:
     return _GRUPO_MAP.get(grupo.strip().upper(), grupo.strip().upper())
 
 
+@functools.lru_cache(maxsize=8192)
 def short_name(prod: str) -> str:
     up = prod.upper()
     for p in _SHORT_PREFIXES:
@@ -5627,7 +5621,10 @@ def parse_estoque_format(df_raw: pd.DataFrame) -> tuple:
                 nota_raw = ""
 
         categoria = classify_product(produto)
-        qtd_fisica, diferenca, obs, status = parse_annotation(nota_raw, qtd_sistema)
+        if nota_raw:
+            qtd_fisica, diferenca, obs, status = parse_annotation(nota_raw, qtd_sistema)
+        else:
+            qtd_fisica, diferenca, obs, status = qtd_sistema, 0, "", "ok"
 
         records.append({
             "codigo": codigo, "produto": produto, "categoria": categoria,
@@ -5676,72 +5673,82 @@ def parse_vendas_format(df_raw: pd.DataFrame) -> tuple:
     if not col_qtd_estoque and not col_qtd_vendida:
         return (False, "Nenhuma coluna de quantidade encontrada.", [])
 
-    records = []
-    zerados = []
-    current_grupo = "OUTROS"
-
-    for _, row in df.iterrows():
-        if col_grupo:
-            g = str(row.get(col_grupo, "")).strip()
-            if g and g.upper() not in ("NAN", "NONE", ""):
-                current_grupo = g
-
-        raw_prod = str(row.get(col_produto, "")).strip()
-        if not raw_prod or raw_prod.upper() in ("NAN", "NONE", "ROLLUP"):
-            continue
-
-        m = _RE_COD_PROD.match(raw_prod)
-        if m:
-            codigo, produto = m.group(1).strip(), m.group(2).strip()
-        else:
-            codigo = "AUTO_" + _RE_NON_ALNUM.sub("", raw_prod.upper())[:20]
-            produto = raw_prod
-
-        qtd_sistema = qtd_vendida_val = 0
-        if col_qtd_estoque:
-            try:
-                val = row.get(col_qtd_estoque)
-                if pd.notna(val):
-                    qtd_sistema = int(float(val))
-            except (ValueError, TypeError):
-                pass
-        if col_qtd_vendida:
-            try:
-                val = row.get(col_qtd_vendida)
-                if pd.notna(val):
-                    qtd_vendida_val = int(float(val))
-            except (ValueError, TypeError):
-                pass
-
-        if qtd_sistema <= 0:
-            if qtd_vendida_val > 0:
-                zerados.append({
-                    "codigo": codigo, "produto": produto,
-                    "grupo": normalize_grupo(current_grupo),
-                    "qtd_vendida": qtd_vendida_val, "qtd_estoque": 0,
-                })
-            continue
-
-        nota_raw = ""
-        if col_nota:
-            nv = str(row.get(col_nota, "")).strip()
-            if nv.upper() not in ("NAN", "NONE", "") and not _RE_ONLY_NUMBER.match(nv):
-                nota_raw = nv
-
-        categoria = normalize_grupo(current_grupo)
-        if categoria in ("OUTROS", ""):
-            categoria = classify_product(produto)
+    # Colunas inteiras de uma vez (operações vetorizadas do pandas) em vez de
+    # row.get / pd.notna / int(float()) / regex célula a célula.
+    df = df.loc[:, ~df.columns.duplicated()]
+
+    def _txt(col) -> pd.Series:
+        return df[col].astype(str).str.strip()
+
+    def _qtd(col) -> pd.Series:
+        if not col:
+            return pd.Series(0, index=df.index)
+        v = pd.to_numeric(df[col], errors="coerce").replace([np.inf, -np.inf], np.nan)
+        return v.fillna(0).astype(int)
+
+    # Grupo vem só na 1ª linha de cada bloco: propaga para baixo (ffill)
+    if col_grupo:
+        g = _txt(col_grupo)
+        # Coluna de grupo toda vazia vira object só de NaN, e o ffill do pandas 2.x
+        # emite FutureWarning de downcast silencioso: opta pelo comportamento novo.
+        with pd.option_context("future.no_silent_downcasting", True):
+            grupos = g.where(~g.str.upper().isin(_VALORES_VAZIOS)).ffill().fillna("OUTROS")
+    else:
+        grupos = pd.Series("OUTROS", index=df.index)
+
+    raw_prod = _txt(col_produto)
+    valido = ~raw_prod.str.upper().isin(_VALORES_VAZIOS | {"ROLLUP"})
+
+    cod_prod = raw_prod.str.extract(_RE_COD_PROD)
+    achou = cod_prod[0].notna()
+    auto = "AUTO_" + raw_prod.str.upper().str.replace(_RE_NON_ALNUM, "", regex=True).str[:20]
+
+    base = pd.DataFrame({
+        "codigo": cod_prod[0].str.strip().where(achou, auto),
+        "produto": cod_prod[1].str.strip().where(achou, raw_prod),
+        "grupo": grupos.map(normalize_grupo),
+        "qtd_sistema": _qtd(col_qtd_estoque),
+        "qtd_vendida": _qtd(col_qtd_vendida),
+        "nota": _txt(col_nota) if col_nota else "",
+    })[valido]
+
+    sem_estoque = base["qtd_sistema"] <= 0
+    zerados = (
+        base.loc[sem_estoque & (base["qtd_vendida"] > 0), ["codigo", "produto", "grupo", "qtd_vendida"]]
+        .assign(qtd_estoque=0)
+        .to_dict(orient="records")
+    )
 
-        qtd_fisica, diferenca, obs, status = parse_annotation(nota_raw, qtd_sistema)
+    com_estoque = base.loc[~sem_estoque]
+    if com_estoque.empty:
+        return (False, "Nenhum dado válido na planilha de vendas.", [])
 
-        records.append({
-            "codigo": codigo, "produto": produto, "categoria": categoria,
-            "qtd_sistema": qtd_sistema, "qtd_fisica": qtd_fisica,
-            "diferenca": diferenca, "nota": obs, "status": status,
-            "qtd_vendida": qtd_vendida_val,
-        })
+    notas = com_estoque["nota"]
+    notas = notas.where(~notas.str.upper().isin(_VALORES_VAZIOS) & ~notas.str.match(_RE_ONLY_NUMBER), "")
+    categorias = [
+        classify_product(prod) if grp in ("OUTROS", "") else grp
+        for grp, prod in zip(com_estoque["grupo"], com_estoque["produto"])
+    ]
+    anot = pd.DataFrame(
+        # Maioria das linhas vem sem anotação: resolve inline sem chamar parse_annotation
+        [parse_annotation(n, q) if n else (q, 0, "", "ok")
+         for n, q in zip(notas, com_estoque["qtd_sistema"])],
+        columns=["qtd_fisica", "diferenca", "nota", "status"],
+        index=com_estoque.index,
+    )
+    records = pd.DataFrame({
+        "codigo": com_estoque["codigo"],
+        "produto": com_estoque["produto"],
+        "categoria": categorias,
+        "qtd_sistema": com_estoque["qtd_sistema"],
+        "qtd_fisica": anot["qtd_fisica"],
+        "diferenca": anot["diferenca"],
+        "nota": anot["nota"],
+        "status": anot["status"],
+        "qtd_vendida": com_estoque["qtd_vendida"],
+    }).to_dict(orient="records")
 
-    return (True, records, zerados) if records else (False, "Nenhum dado válido na planilha de vendas.", [])
+    return (True, records, zerados)
 
 
 def parse_parcial_estoque(df_raw: pd.DataFrame) -> tuple:
@@ -5813,7 +5820,10 @@ def parse_parcial_estoque(df_raw: pd.DataFrame) -> tuple:
                 nota_raw = nv
 
         categoria = classify_product(produto)
-        qtd_fisica, diferenca, obs, status = parse_annotation(nota_raw, qtd_sistema)
+        if nota_raw:
+            qtd_fisica, diferenca, obs, status = parse_annotation(nota_raw, qtd_sistema)
+        else:
+            qtd_fisica, diferenca, obs, status = qtd_sistema, 0, "", "ok"
 
         records.append({
             "codigo": codigo,
@@ -5829,9 +5839,24 @@ def parse_parcial_estoque(df_raw: pd.DataFrame) -> tuple:
     return (True, records) if records else (False, "Nenhum dado válido na planilha de estoque parcial.")
 
 
+def _read_planilha_raw(uploaded_file) -> pd.DataFrame:
+    """Lê a 1ª aba da planilha sem cabeçalho (o parser acha o header depois).
+
+    Usa o leitor calamine (Rust; bem mais rápido que o openpyxl e também lê
+    .xls) quando o python-calamine está instalado; senão cai no openpyxl.
+    """
+    try:
+        return pd.read_excel(uploaded_file, sheet_name=0, header=None, engine="calamine")
+    except (ImportError, ValueError):
+        # python-calamine ausente (ImportError) ou pandas < 2.2 sem o engine
+        if hasattr(uploaded_file, "seek"):
+            uploaded_file.seek(0)
+        return pd.read_excel(uploaded_file, sheet_name=0, header=None)
+
+
 def read_excel_to_records(uploaded_file) -> tuple:
     try:
-        df_raw = pd.read_excel(uploaded_file, sheet_name=0, header=None)
+        df_raw = _read_planilha_raw(uploaded_file)
     except Exception as e:
         return (False, f"Erro ao ler arquivo: {e}", [])
 
@@ -5855,6 +5880,49 @@ def read_excel_to_records(uploaded_file) -> tuple:
 # UPLOADS — batch inserts + sync único no final
 # ══════════════════════════════════════════════════════════════════════════════
 
+# SQL fixo das escritas de upload, montado uma vez no import (o libsql não expõe
+# prepare(); o texto idêntico ainda reaproveita o statement cache da conexão).
+_SQL_INSERT_HIST_UPLOAD = """
+    INSERT INTO historico_uploads (data, tipo, arquivo, total_produtos_lote, novos, atualizados, divergentes)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+_SQL_RESTAURA_DIV_MESTRE = """
+    UPDATE estoque_mestre
+       SET status = ?,
+           diferenca = ?,
+           qtd_fisica = qtd_sistema + ?
+     WHERE codigo = ? AND status = 'ok'
+"""
+# Fallback (SQLite < 3.33) do UPDATE ... FROM VALUES de upload_parcial.
+# qtd_sistema aparece duas vezes: uma para atualizar, outra para o CASE de qtd_fisica
+_SQL_UPDATE_PARCIAL = """
+    UPDATE estoque_mestre SET
+        produto=?, categoria=?, qtd_sistema=?,
+        qtd_fisica = CASE WHEN status IN ('falta', 'sobra') THEN ? + diferenca ELSE ? END,
+        diferenca = CASE WHEN status IN ('falta', 'sobra') THEN diferenca ELSE ? END,
+        nota=?,
+        status = CASE WHEN status IN ('falta', 'sobra') THEN status ELSE ? END,
+        ultima_contagem=?
+    WHERE codigo=?
+"""
+_SQL_ACUMULA_REPO = """
+    UPDATE reposicao_loja
+    SET qtd_vendida = qtd_vendida + ?
+    WHERE codigo = ? AND reposto = 0
+"""
+_SQL_INSERT_VH = """
+    INSERT INTO vendas_historico
+        (codigo, produto, grupo, qtd_vendida, qtd_estoque, data_upload)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+_SQL_UPDATE_VH_DIA = """
+    UPDATE vendas_historico
+       SET qtd_vendida = ?,
+           qtd_estoque = ?
+     WHERE codigo = ? AND data_upload = ?
+"""
+
+
 def upload_mestre(records: list, do_sync: bool = True) -> tuple:
     """Recebe records já parseados (sem re-parsear o arquivo)."""
     try:
@@ -5871,38 +5939,23 @@ def upload_mestre(records: list, do_sync: bool = True) -> tuple:
         ).fetchall()}
 
         n_div = sum(1 for r in records if r.get("status") in ("falta", "sobra"))
-        conn.execute("""
-            INSERT INTO historico_uploads (data, tipo, arquivo, total_produtos_lote, novos, atualizados, divergentes)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, [now, "MESTRE", "", len(records), len(records), 0, n_div])
+        conn.execute(_SQL_INSERT_HIST_UPLOAD, [now, "MESTRE", "", len(records), len(records), 0, n_div])
         upload_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
 
         detectar_e_registrar_variacoes(records, conn, now, upload_id)
 
         conn.execute("DELETE FROM estoque_mestre")
 
-        # BATCH INSERT via executemany
-        conn.executemany("""
-            INSERT INTO estoque_mestre
-                (codigo, produto, categoria, qtd_sistema, qtd_fisica, diferenca, nota, status, ultima_contagem, criado_em)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, [
-            (r["codigo"], r["produto"], r["categoria"],
-             r["qtd_sistema"], r["qtd_fisica"], r["diferenca"],
-             r["nota"], r["status"], now, now)
-            for r in records
-        ])
+        # BATCH INSERT multi-linha (1 statement por chunk)
+        _insert_many(conn, "estoque_mestre", [*_REC_ESTOQUE_COLS, "ultima_contagem", "criado_em"],
+                     ((*_rec_estoque_tuple(r), now, now) for r in records))
 
         # Restaurar status e diferenca de divergência para produtos que já estavam divergentes.
         # qtd_fisica é recalculado como qtd_sistema + diferenca preservada.
         # (só sobrescreve se o novo upload não trouxe uma nova divergência)
         if existing_div:
             conn.executemany(
-                """UPDATE estoque_mestre
-                   SET status = ?,
-                       diferenca = ?,
-                       qtd_fisica = qtd_sistema + ?
-                   WHERE codigo = ? AND status = 'ok'""",
+                _SQL_RESTAURA_DIV_MESTRE,
                 [(status, dif, dif, codigo) for codigo, (status, dif) in existing_div.items()]
             )
 
@@ -5949,32 +6002,24 @@ def upload_parcial(records: list, zerados: list = None, do_sync: bool = True) ->
         if zerados:
             codigos_zerados = [z["codigo"] if isinstance(z, dict) else z for z in zerados]
             codigos_remover = [c for c in codigos_zerados if c in existing]
-            if codigos_remover:
-                ph = ",".join(["?" for _ in codigos_remover])
-                conn.execute(f"DELETE FROM estoque_mestre WHERE codigo IN ({ph})", codigos_remover)
+            # IN em chunks: 1 statement por chunk e nunca passa do limite de parâmetros
+            for chunk in _chunks(codigos_remover, _BATCH_MAX_PARAMS):
+                ph = ",".join("?" * len(chunk))
+                conn.execute(f"DELETE FROM estoque_mestre WHERE codigo IN ({ph})", chunk)
 
         novos_data, update_data = [], []
         for r in records:
-            # qtd_sistema aparece duas vezes: uma para atualizar, outra para o CASE de qtd_fisica
-            row_data = (
-                r["produto"], r["categoria"], r["qtd_sistema"],
-                r["qtd_sistema"], r["qtd_fisica"], r["diferenca"],
-                r["nota"], r["status"], now, r["codigo"]
-            )
             if r["codigo"] in existing:
-                update_data.append(row_data)
-            else:
-                novos_data.append((
+                update_data.append((
                     r["codigo"], r["produto"], r["categoria"],
                     r["qtd_sistema"], r["qtd_fisica"], r["diferenca"],
-                    r["nota"], r["status"], now, now
+                    r["nota"], r["status"], now,
                 ))
+            else:
+                novos_data.append((*_rec_estoque_tuple(r), now, now))
 
         n_div = sum(1 for r in records if r["status"] != "ok")
-        conn.execute("""
-            INSERT INTO historico_uploads (data, tipo, arquivo, total_produtos_lote, novos, atualizados, divergentes)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, [now, "PARCIAL", "", len(records), len(novos_data), len(update_data), n_div])
+        conn.execute(_SQL_INSERT_HIST_UPLOAD, [now, "PARCIAL", "", len(records), len(novos_data), len(update_data), n_div])
         upload_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
 
         detectar_e_registrar_variacoes(records, conn, now, upload_id, include_novos=True)
@@ -5983,36 +6028,46 @@ def upload_parcial(records: list, zerados: list = None, do_sync: bool = True) ->
         # Preserva status, diferenca e qtd_fisica para produtos com divergência existente.
         # qtd_fisica é recalculado como novo qtd_sistema + diferenca preservada, mantendo
         # a quantidade de falta/sobra anotada independente de novos uploads.
+        # O join com estoque_mestre é feito pelo próprio SQLite (UPDATE ... FROM VALUES),
+        # 1 statement por chunk em vez de 1 UPDATE por linha.
         if update_data:
-            conn.executemany("""
-                UPDATE estoque_mestre SET
-                    produto=?, categoria=?, qtd_sistema=?,
-                    qtd_fisica = CASE WHEN status IN ('falta', 'sobra') THEN ? + diferenca ELSE ? END,
-                    diferenca = CASE WHEN status IN ('falta', 'sobra') THEN diferenca ELSE ? END,
-                    nota=?,
-                    status = CASE WHEN status IN ('falta', 'sobra') THEN status ELSE ? END,
-                    ultima_contagem=?
-                WHERE codigo=?
-            """, update_data)
+            if _supports_update_from(conn):
+                chunk_rows = max(1, _BATCH_MAX_PARAMS // 9)
+                for chunk in _chunks(update_data, chunk_rows):
+                    ph = ", ".join("(?, ?, ?, ?, ?, ?, ?, ?, ?)" for _ in chunk)
+                    flat = [v for row in chunk for v in row]
+                    conn.execute(f"""
+                        UPDATE estoque_mestre AS em SET
+                            produto = v.pr, categoria = v.cat, qtd_sistema = v.qs,
+                            qtd_fisica = CASE WHEN em.status IN ('falta', 'sobra') THEN v.qs + em.diferenca ELSE v.qf END,
+                            diferenca = CASE WHEN em.status IN ('falta', 'sobra') THEN em.diferenca ELSE v.dif END,
+                            nota = v.nt,
+                            status = CASE WHEN em.status IN ('falta', 'sobra') THEN em.status ELSE v.st END,
+                            ultima_contagem = v.uc
+                        FROM (SELECT column1 AS codigo, column2 AS pr, column3 AS cat,
+                                     column4 AS qs, column5 AS qf, column6 AS dif,
+                                     column7 AS nt, column8 AS st, column9 AS uc
+                              FROM (VALUES {ph})) AS v
+                        WHERE em.codigo = v.codigo
+                    """, flat)
+            else:
+                conn.executemany(_SQL_UPDATE_PARCIAL, [(pr, cat, qs, qs, qf, dif, nt, st_, uc, cod)
+                                                       for cod, pr, cat, qs, qf, dif, nt, st_, uc in update_data])
 
         if novos_data:
-            conn.executemany("""
-                INSERT INTO estoque_mestre
-                    (codigo, produto, categoria, qtd_sistema, qtd_fisica, diferenca, nota, status, ultima_contagem, criado_em)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, novos_data)
+            _insert_many(conn, "estoque_mestre", [*_REC_ESTOQUE_COLS, "ultima_contagem", "criado_em"], novos_data)
             # Auto-cachear P.A. para produtos que entraram ou voltaram ao estoque
             _auto_cache_principios_ativos([r[1] for r in novos_data], conn)
 
         # Invalida ciclo dos produtos que movimentaram
-        if invalidar_ciclo:
-            ph = ",".join(["?" for _ in invalidar_ciclo])
+        for chunk in _chunks(invalidar_ciclo, _BATCH_MAX_PARAMS):
+            ph = ",".join("?" * len(chunk))
             conn.execute(f"""
                 UPDATE estoque_mestre
                 SET status_ciclo = '', qtd_contada_ciclo = NULL,
                     qtd_sistema_na_contagem = NULL, contado_ciclo_em = ''
                 WHERE codigo IN ({ph})
-            """, invalidar_ciclo)
+            """, chunk)
 
         # Reposição loja
         n_repo = _detectar_reposicao_batch(records, conn, now)
@@ -6106,18 +6161,11 @@ def upload_parcial_estoque(records: list, do_sync: bool = True) -> tuple:
                             r["diferenca"], r["status"], now,
                         ))
             else:
-                novos_data.append((
-                    r["codigo"], r["produto"], r["categoria"],
-                    r["qtd_sistema"], r["qtd_fisica"], r["diferenca"],
-                    r["nota"], r["status"], now, now,
-                ))
+                novos_data.append((*_rec_estoque_tuple(r), now, now))
 
         n_atualizados = len(update_data) + len(update_nota_data) + len(touch_only)
         n_div = sum(1 for r in records if r["status"] != "ok")
-        conn.execute("""
-            INSERT INTO historico_uploads (data, tipo, arquivo, total_produtos_lote, novos, atualizados, divergentes)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, [now, "PARCIAL_ESTOQUE", "", len(records), len(novos_data), n_atualizados, n_div])
+        conn.execute(_SQL_INSERT_HIST_UPLOAD, [now, "PARCIAL_ESTOQUE", "", len(records), len(novos_data), n_atualizados, n_div])
         upload_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
 
         detectar_e_registrar_variacoes(
@@ -6191,10 +6239,7 @@ def upload_parcial_estoque(records: list, do_sync: bool = True) -> tuple:
                 )
 
         if novos_data:
-            _insert_many(conn, "estoque_mestre", [
-                "codigo", "produto", "categoria", "qtd_sistema", "qtd_fisica",
-                "diferenca", "nota", "status", "ultima_contagem", "criado_em",
-            ], novos_data)
+            _insert_many(conn, "estoque_mestre", [*_REC_ESTOQUE_COLS, "ultima_contagem", "criado_em"], novos_data)
             # Auto-cachear P.A. para produtos que entraram ou voltaram ao estoque
             _auto_cache_principios_ativos([r[1] for r in novos_data], conn)
 
@@ -6435,37 +6480,88 @@ def limpar_contagem() -> None:
     sync_db()
 
 
+_repo_upsert_supported: bool | None = None
+
+
+def _supports_repo_upsert(conn) -> bool:
+    """UPSERT na reposição requer o índice único parcial ux_repo_pendente (SQLite >= 3.24).
+
+    O índice é criado pelo script avulso migrar_repo_pendente.py (consolida as
+    pendências duplicadas antes); sem ele, o upload segue pelo caminho antigo.
+    """
+    global _repo_upsert_supported
+    if _repo_upsert_supported is None:
+        try:
+            _repo_upsert_supported = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_repo_pendente'"
+            ).fetchone() is not None
+        except Exception:
+            _repo_upsert_supported = False
+    return _repo_upsert_supported
+
+
 def _detectar_reposicao_batch(records: list, conn, now: str) -> int:
-    """Detecta reposição em batch. Acumula qtd_vendida para pendências existentes."""
+    """Detecta reposição em batch. Acumula qtd_vendida para pendências existentes.
+
+    records já vem desduplicado por código (upload_parcial).
+    """
+    if not records:
+        return 0
+
+    # Filtro numa passada vetorizada; as linhas saem do próprio records (tipos nativos p/ o driver)
+    df_r = pd.DataFrame.from_records(records, columns=["codigo", "categoria", "qtd_vendida"])
+    qtd_v = pd.to_numeric(df_r["qtd_vendida"], errors="coerce").fillna(0)
+    cat = df_r["categoria"].fillna("").astype(str).str.strip().str.upper()
+    elegivel = (qtd_v > 0) & ~cat.isin(CATEGORIAS_EXCLUIDAS_REPOSICAO)
+
+    if _supports_repo_upsert(conn):
+        # ux_repo_pendente garante 1 pendência por código: o próprio INSERT acumula
+        # qtd_vendida no conflito, sem o SELECT das pendências antes.
+        rows = [
+            (r["codigo"], r["produto"], r["categoria"], r.get("qtd_vendida", 0), now)
+            for r in map(records.__getitem__, np.flatnonzero(elegivel))
+        ]
+        for chunk in _chunks(rows, max(1, _BATCH_MAX_PARAMS // 5)):
+            ph = ", ".join("(?, ?, ?, ?, ?)" for _ in chunk)
+            flat = [v for row in chunk for v in row]
+            conn.execute(f"""
+                INSERT INTO reposicao_loja (codigo, produto, categoria, qtd_vendida, criado_em)
+                VALUES {ph}
+                ON CONFLICT(codigo) WHERE reposto = 0
+                DO UPDATE SET qtd_vendida = qtd_vendida + excluded.qtd_vendida
+            """, flat)
+        return len(rows)
+
     pending = {row[0] for row in conn.execute("SELECT codigo FROM reposicao_loja WHERE reposto = 0").fetchall()}
-    to_insert = []
-    to_update = []  # (qtd_adicional, codigo) para produtos já pendentes
+    ja_pendente = df_r["codigo"].isin(pending)
 
-    for r in records:
-        qtd_v = r.get("qtd_vendida", 0)
-        if qtd_v <= 0:
-            continue
-        cat = str(r.get("categoria", "")).strip().upper()
-        if cat in CATEGORIAS_EXCLUIDAS_REPOSICAO:
-            continue
-        if r["codigo"] in pending:
-            to_update.append((qtd_v, r["codigo"]))
-        else:
-            to_insert.append((r["codigo"], r["produto"], r["categoria"], qtd_v, now))
-            pending.add(r["codigo"])
+    to_insert = [
+        (r["codigo"], r["produto"], r["categoria"], r.get("qtd_vendida", 0), now)
+        for r in map(records.__getitem__, np.flatnonzero(elegivel & ~ja_pendente))
+    ]
+    # (codigo, qtd_adicional) para produtos já pendentes
+    to_update = [
+        (r["codigo"], r.get("qtd_vendida", 0))
+        for r in map(records.__getitem__, np.flatnonzero(elegivel & ja_pendente))
+    ]
 
-    if to_insert:
-        conn.executemany("""
-            INSERT INTO reposicao_loja (codigo, produto, categoria, qtd_vendida, criado_em)
-            VALUES (?, ?, ?, ?, ?)
-        """, to_insert)
+    _insert_many(conn, "reposicao_loja",
+                 ["codigo", "produto", "categoria", "qtd_vendida", "criado_em"], to_insert)
 
     if to_update:
-        conn.executemany("""
-            UPDATE reposicao_loja
-            SET qtd_vendida = qtd_vendida + ?
-            WHERE codigo = ? AND reposto = 0
-        """, to_update)
+        if _supports_update_from(conn):
+            chunk_rows = max(1, _BATCH_MAX_PARAMS // 2)
+            for chunk in _chunks(to_update, chunk_rows):
+                ph = ", ".join("(?, ?)" for _ in chunk)
+                flat = [v for row in chunk for v in row]
+                conn.execute(f"""
+                    UPDATE reposicao_loja AS rl
+                    SET qtd_vendida = rl.qtd_vendida + v.qtd
+                    FROM (SELECT column1 AS codigo, column2 AS qtd FROM (VALUES {ph})) AS v
+                    WHERE rl.codigo = v.codigo AND rl.reposto = 0
+                """, flat)
+        else:
+            conn.executemany(_SQL_ACUMULA_REPO, [(qtd, cod) for cod, qtd in to_update])
 
     return len(to_insert) + len(to_update)
 
@@ -6658,15 +6754,17 @@ def _rack_html(paletes: dict, rua: str, face: str, highlight_keys: set = None) -
     NIVEIS  = 4
     hl = highlight_keys or set()
 
-    col_heads = '<div class="mr-row"><div class="mr-lvl"></div>'
-    for c in range(1, COLUNAS + 1):
-        col_heads += f'<div class="mr-chd">C{c}</div>'
-    col_heads += '</div>'
+    col_heads = (
+        '<div class="mr-row"><div class="mr-lvl"></div>'
+        + "".join([f'<div class="mr-chd">C{c}</div>' for c in range(1, COLUNAS + 1)])
+        + '</div>'
+    )
 
-    rows_html = ""
+    # 4 níveis × 13 colunas de fragmentos: acumula em lista e junta uma vez
+    rows = []
     for nivel in range(NIVEIS, 0, -1):
-        rows_html += '<div class="mr-row">'
-        rows_html += f'<div class="mr-lvl">N{nivel}</div>'
+        rows.append('<div class="mr-row">')
+        rows.append(f'<div class="mr-lvl">N{nivel}</div>')
         for col in range(1, COLUNAS + 1):
             pk = f"{rua}-{face}-C{col}-N{nivel}"
             pk_j = pk.replace("'", "\\'")
@@ -6680,7 +6778,7 @@ def _rack_html(paletes: dict, rua: str, face: str, highlight_keys: set = None) -
                 nome_c  = short_name(produto)          # nome comercial sem categoria
                 short   = (nome_c[:9] + "…") if len(nome_c) > 10 else nome_c
                 qty_str = f"{qtd} {unidade}".strip() if qtd is not None else ""
-                rows_html += (
+                rows.append(
                     f'<div class="mr-cell occ" draggable="true"'
                     f' style="background:{bg};color:#0f172a;"'
                     f' title="↕ Arraste · {produto} — {qty_str}"'
@@ -6692,14 +6790,15 @@ def _rack_html(paletes: dict, rua: str, face: str, highlight_keys: set = None) -
                     f'</div>'
                 )
             else:
-                rows_html += (
+                rows.append(
                     f'<div class="mr-cell emp" title="{pk}"'
                     f' ondragover="dOver(event,this)"'
                     f' ondragleave="dLeave(this)"'
                     f' ondrop="dDrop(event,\'{pk_j}\')">'
                     f'·</div>'
                 )
-        rows_html += '</div>'
+        rows.append('</div>')
+    rows_html = "".join(rows)
 
     js = """<script>
 function dStart(e,pk){
@@ -7382,6 +7481,145 @@ def render_mapa_visual(conn):
     st.plotly_chart(fig_hm, use_container_width=True)
 
 
+# ── Treemap: estilos e templates dos cards (montados 1x no import) ──────────
+# O HTML de cada card é ~1 KB de CSS constante: os templates %-format abaixo
+# guardam esse boilerplate e o loop só preenche os trechos dinâmicos.
+
+# Badge de categoria: (fundo, cor do texto)
+_TM_CAT_STYLES = {
+    "HERBICIDA":    ("rgba(34,197,94,0.12)",   "#22c55e"),
+    "FUNGICIDA":    ("rgba(59,130,246,0.12)",   "#3b82f6"),
+    "INSETICIDA":   ("rgba(168,85,247,0.12)",   "#a855f7"),
+    "FERTILIZANTE": ("rgba(234,179,8,0.12)",    "#eab308"),
+    "SEMENTE":      ("rgba(249,115,22,0.12)",   "#f97316"),
+    "ACARICIDA":    ("rgba(6,182,212,0.12)",    "#06b6d4"),
+    "ADJUVANTE":    ("rgba(100,116,139,0.12)",  "#94a3b8"),
+    "OUTROS":       ("rgba(100,116,139,0.12)",  "#94a3b8"),
+}
+_TM_CAT_DEFAULT = ("rgba(100,116,139,0.12)", "#94a3b8")
+
+# Paletas do card: (cor da borda, fundo, cor da quantidade, estilo da borda).
+# O ramo de status escolhe uma tupla em vez de atribuir 4 strings por card.
+_TM_COL_AVARIA = ("#f97316", "linear-gradient(135deg, rgba(249,115,22,0.08), #1a1d2e)", "#f97316",
+                  "border:1px solid rgba(255,255,255,0.06);border-left:3px solid #f97316;")
+_TM_COL_OK = ("#22c55e", "#1a1d2e", "#e8eaf0",
+              "border:1px solid rgba(255,255,255,0.06);border-left:3px solid #22c55e;")
+_TM_COL_FALTA = ("#ef4444", "linear-gradient(135deg, rgba(239,68,68,0.28), rgba(180,20,20,0.18))", "#ffffff",
+                 "border:2px solid rgba(239,68,68,0.7);")
+_TM_COL_SOBRA = ("#06b6d4", "linear-gradient(135deg, rgba(6,182,212,0.28), rgba(0,100,140,0.18))", "#ffffff",
+                 "border:2px solid rgba(6,182,212,0.7);")
+# Índices do np.select do modo divergência: avaria, ok, falta, sobra
+_TM_PALETAS_DIV = (_TM_COL_AVARIA, _TM_COL_OK, _TM_COL_FALTA, _TM_COL_SOBRA)
+# Modo cíclico
+_TM_COL_CICLO_FALTA = ("#ff4757", "rgba(255,71,87,0.72)", "#ffffff", "border:2px solid #ff4757;")
+_TM_COL_CICLO_SOBRA = ("#06b6d4", "rgba(6,182,212,0.72)", "#ffffff", "border:2px solid #06b6d4;")
+_TM_COL_CICLO_OK = ("#00d68f", "rgba(0,214,143,0.72)", "#ffffff", "border:2px solid #00d68f;")
+_TM_COL_CICLO_PENDENTE = ("#ffa502", "linear-gradient(135deg, rgba(255,165,2,0.12), #1a1d2e)", "#e8eaf0",
+                          "border:1px solid rgba(255,255,255,0.06);border-left:3px solid #ffa502;")
+
+# (cor da bolinha, código)
+_TM_BADGE_CICLO_TMPL = (
+    '<div style="display:inline-flex;align-items:center;gap:5px;'
+    'font-size:11px;font-family:\'JetBrains Mono\',monospace;font-weight:600;'
+    'padding:3px 8px;border-radius:6px;'
+    'background:rgba(255,255,255,0.07);color:#e8eaf0;margin-bottom:10px;flex-shrink:0;">'
+    '<span style="width:6px;height:6px;border-radius:50%%;background:%s;flex-shrink:0;"></span>'
+    '%s</div>'
+)
+# (fundo, cor do texto, cor da bolinha, categoria)
+_TM_BADGE_CAT_TMPL = (
+    '<div style="display:inline-flex;align-items:center;gap:5px;'
+    'font-size:9px;text-transform:uppercase;letter-spacing:1.2px;'
+    'font-weight:600;padding:3px 8px;border-radius:6px;'
+    'background:%s;color:%s;margin-bottom:10px;flex-shrink:0;">'
+    '<span style="width:6px;height:6px;border-radius:50%%;background:%s;flex-shrink:0;"></span>'
+    '%s</div>'
+)
+# (qtd avariada)
+_TM_AVARIA_BADGE_TMPL = (
+    '<div style="position:absolute;top:10px;right:10px;'
+    'font-size:10px;font-weight:600;font-family:\'JetBrains Mono\',monospace;'
+    'padding:2px 7px;border-radius:6px;'
+    'background:rgba(249,115,22,0.12);color:#f97316;">⚠ %s av.</div>'
+)
+# (▲/▼, |diferença|)
+_TM_DIFF_BADGE_TMPL = (
+    '<div style="position:absolute;top:10px;right:10px;'
+    'font-size:10px;font-weight:600;font-family:\'JetBrains Mono\',monospace;'
+    'padding:2px 7px;border-radius:6px;'
+    'background:rgba(255,255,255,0.18);color:#ffffff;">%s%s</div>'
+)
+# (cor, dd/mmm/aaaa)
+_TM_VENC_TMPL = (
+    '<div style="margin-top:6px;font-size:9px;font-weight:600;'
+    'font-family:\'JetBrains Mono\',monospace;letter-spacing:0.4px;'
+    'color:%s;">venc. %s</div>'
+)
+# (dd/mm)
+_TM_CICLO_DATE_TMPL = (
+    '<div style="margin-top:6px;font-size:10px;font-weight:600;'
+    'font-family:\'JetBrains Mono\',monospace;letter-spacing:0.3px;'
+    'color:rgba(255,255,255,0.92);">📅 %s</div>'
+)
+# (cooperados)
+_TM_COOP_POPUP_TMPL = (
+    '<div style="font-size:0.82rem;font-weight:600;color:#e2e8f0;margin-top:6px;'
+    'border-top:1px solid rgba(255,255,255,0.12);padding-top:6px;">'
+    '&#x1F464; %s</div>'
+)
+# (comentário, sufixo de data — vazio ou _TM_OBS_DATE_TMPL)
+_TM_OBS_POPUP_TMPL = (
+    '<div style="font-size:0.78rem;font-weight:500;color:#cbd5e1;margin-top:6px;'
+    'border-top:1px solid rgba(255,255,255,0.12);padding-top:6px;">'
+    '&#x1F4AC; %s%s</div>'
+)
+_TM_OBS_DATE_TMPL = ' <span style="color:#94a3b8;">&middot; %s</span>'
+# (classe de validade, código, produto, código normalizado, data-ctx, fundo,
+#  borda, opacidade, badge categoria, badge diff/avaria, nome curto, cor da qtd,
+#  qtd, label validade, label ciclo, código, código, produto, popup cooperado,
+#  popup comentário)
+_TM_TILE_TMPL = (
+    '<div class="tm-tile%s" tabindex="0" title="%s — %s"'
+    ' data-codigo="%s"'
+    '%s'
+    ' style="background:%s;%s'
+    'border-radius:12px;padding:14px;position:relative;%s">'
+    '%s'
+    '%s'
+    '<div class="tm-name">%s</div>'
+    '<div class="tm-info" style="color:%s;">%s</div>'
+    '%s'
+    '%s'
+    '<div class="tm-cod">%s</div>'
+    '<div class="tm-popup"><div class="tm-popup-code">%s</div>%s%s%s</div>'
+    '</div>'
+)
+# (categoria, nº de produtos, cards)
+# Abertura/fechamento da categoria e do treemap em partes fixas: os tiles vão
+# direto para uma lista única e o HTML inteiro sai de um só "".join.
+_TM_CAT_HEAD_TMPL = (
+    '<div style="width:100%%;background:#111827;border-radius:8px;padding:8px;'
+    'margin-bottom:8px;border:1px solid #1e293b;">'
+    '<div style="font-size:0.75rem;color:#64748b;font-weight:700;text-transform:uppercase;'
+    'margin-bottom:6px;border-bottom:1px solid #1e293b;padding-bottom:4px;">'
+    '%s <span style="font-size:0.6rem;color:#4a5568;font-weight:400;">(%d)</span></div>'
+    '<div class="tm-wrap">'
+)
+_TM_CAT_TAIL = '</div></div>'
+_TM_WRAP_HEAD = '<div style="display:flex;flex-direction:column;min-height:450px;">'
+_TM_WRAP_TAIL = '</div>'
+
+
+# Função pura dos argumentos: o st.cache_data hasheia df/dicts, então reruns sem
+# mudança de dado (clique, troca de aba) reaproveitam o HTML. O ttl mantém os
+# rótulos de validade (dependem de date.today()) atualizados.
+# sort_fn (ex.: _sort_ciclo do inventário cíclico) é função, que o Streamlit não
+# sabe hashear: entra na chave pelo nome qualificado, então ordenações
+# diferentes não dividem a mesma entrada.
+@st.cache_data(
+    ttl=300, max_entries=8,
+    hash_funcs={types.FunctionType: lambda f: f"{f.__module__}.{f.__qualname__}"},
+)
 def build_css_treemap(df: pd.DataFrame, filter_cat: str = "TODOS", avarias_map: dict = None, divergencias_map: dict = None, validade_map: dict = None, color_mode: str = "divergencia", sort_fn=None, ctx: str = "", observacoes_map: dict = None) -> str:
     if df.empty:
         return '<div style="color:#64748b;text-align:center;padding:40px;">Nenhum produto para exibir</div>'
@@ -7454,68 +7692,66 @@ def build_css_treemap(df: pd.DataFrame, filter_cat: str = "TODOS", avarias_map:
             else:
                 return "", ""
             fmt = f"{exp.day:02d}/{_MONTHS_PT[exp.month-1]}/{exp.year}"
-            label = (
-                f'<div style="margin-top:6px;font-size:9px;font-weight:600;'
-                f'font-family:\'JetBrains Mono\',monospace;letter-spacing:0.4px;'
-                f'color:{color};">venc. {fmt}</div>'
-            )
-            return blink, label
+            return blink, _TM_VENC_TMPL % (color, fmt)
         except Exception:
             return "", ""
 
-    # Agrupar por categoria
+    # Agrupar por categoria, já em ordem de produto: 1 argsort estável no lugar
+    # de um sorted() por categoria (a ordem dentro de cada grupo é preservada)
+    _ordem = np.argsort(np.array(df["produto"].astype(str).tolist(), dtype=str), kind="stable")
+    df = df.iloc[_ordem]
     categories = {}
-    for _, row in df.iterrows():
-        categories.setdefault(row["categoria"], []).append(row)
-
-    # Category badge style map
-    _CAT_STYLES = {
-        "HERBICIDA":    ("rgba(34,197,94,0.12)",   "#22c55e"),
-        "FUNGICIDA":    ("rgba(59,130,246,0.12)",   "#3b82f6"),
-        "INSETICIDA":   ("rgba(168,85,247,0.12)",   "#a855f7"),
-        "FERTILIZANTE": ("rgba(234,179,8,0.12)",    "#eab308"),
-        "SEMENTE":      ("rgba(249,115,22,0.12)",   "#f97316"),
-        "ACARICIDA":    ("rgba(6,182,212,0.12)",    "#06b6d4"),
-        "ADJUVANTE":    ("rgba(100,116,139,0.12)",  "#94a3b8"),
-        "OUTROS":       ("rgba(100,116,139,0.12)",  "#94a3b8"),
-    }
-    _CAT_DEFAULT = ("rgba(100,116,139,0.12)", "#94a3b8")
+    for i, (_, row) in enumerate(df.iterrows()):
+        categories.setdefault(row["categoria"], []).append((i, row))
+
+    # Colunas por posição (mesma ordem do df): código normalizado, avarias,
+    # diferença do mestre e diferença efetiva (divergências abertas sobrepõem o
+    # mestre). A paleta do modo divergência sai de um np.select só.
+    _cods = [_codigo_key(c) for c in df["codigo"]]
+    _avs = [avarias_map_norm.get(c, 0) for c in _cods]
+    _dif_mestre = (
+        pd.to_numeric(df["diferenca"], errors="coerce").fillna(0).astype(np.int64).to_numpy()
+        if "diferenca" in df.columns else np.zeros(len(df), dtype=np.int64)
+    )
+    _dif_div = np.fromiter(
+        (sum(e["delta"] for e in divergencias_map_norm.get(c, ())) for c in _cods),
+        dtype=np.int64, count=len(_cods),
+    )
+    _dif_efetiva = np.where(_dif_div != 0, _dif_div, _dif_mestre)
+    if color_mode != "ciclico":
+        _av_arr = np.fromiter((a > 0 for a in _avs), dtype=bool, count=len(_avs))
+        _pal_idx = np.select([_av_arr, _dif_efetiva == 0, _dif_efetiva < 0], [0, 1, 2], default=3)
 
     ctx_attr = f' data-ctx="{ctx}"' if ctx else ''
 
-    parts = []
+    parts = [_TM_WRAP_HEAD]
     _sort = sort_fn if sort_fn is not None else sort_categorias
     for cat in _sort(list(categories.keys())):
         rows = categories[cat]
-        prods = []
+        parts.append(_TM_CAT_HEAD_TMPL % (cat, len(rows)))
 
-        for r in sorted(rows, key=lambda x: str(x["produto"])):
+        for i, r in rows:
             qs = int(r["qtd_sistema"])
-            qf = int(r["qtd_fisica"]) if pd.notnull(r.get("qtd_fisica")) else qs
-            diff = int(r["diferenca"]) if pd.notnull(r.get("diferenca")) else 0
             info = str(qs)
 
             contagem = str(r.get("ultima_contagem", ""))
             sem_contagem = not contagem or contagem in ("", "nan", "None")
 
-            cod_str = _codigo_key(r["codigo"])
+            cod_str = _cods[i]
 
             # Aviso de avarias abertas
-            qtd_av = avarias_map_norm.get(cod_str, 0)
+            qtd_av = _avs[i]
 
             # divergencias_map é a fonte de verdade das divergências ativas: sobrepõe
             # estoque_mestre — exceto no inventário cíclico, onde a contagem do ciclo
             # predomina sobre tudo (ver contagem_ciclo_prevalece).
-            _div_entries = divergencias_map_norm.get(cod_str)
-            _ciclo_vence = (color_mode == "ciclico"
-                            and _ciclo_prevalece(r, _div_entries))
-            if _div_entries and not _ciclo_vence:
-                total_div_delta = sum(e["delta"] for e in _div_entries)
-                if total_div_delta != 0:
-                    diff = total_div_delta
+            diff = int(_dif_efetiva[i])
 
             # Status → border color, bg, qty color
             if color_mode == "ciclico":
+                _ciclo_vence = _ciclo_prevalece(r, divergencias_map_norm.get(cod_str))
+                if _ciclo_vence:
+                    diff = int(_dif_mestre[i])
                 status_c = str(r.get("status_ciclo", "") or "")
                 if status_c in ("ok", "divergencia"):
                     # A cor segue a diferença efetiva, não o status gravado —
@@ -7536,82 +7772,30 @@ def build_css_treemap(df: pd.DataFrame, filter_cat: str = "TODOS", avarias_map:
                     # Divergência antiga sem quantidades registradas: mantém vermelho
                     if diff < 0 or (status_c == "divergencia" and diff == 0
                                     and not _tem_contagem):
-                        border_color = "#ff4757"
-                        card_bg = "rgba(255,71,87,0.72)"
+                        palette = _TM_COL_CICLO_FALTA
                     elif diff > 0:
-                        border_color = "#06b6d4"
-                        card_bg = "rgba(6,182,212,0.72)"
+                        palette = _TM_COL_CICLO_SOBRA
                     else:
-                        border_color = "#00d68f"
-                        card_bg = "rgba(0,214,143,0.72)"
-                    qty_color = "#ffffff"
-                    card_border = f"border:2px solid {border_color};"
+                        palette = _TM_COL_CICLO_OK
                 else:
-                    border_color = "#ffa502"
-                    card_bg = "linear-gradient(135deg, rgba(255,165,2,0.12), #1a1d2e)"
-                    qty_color = "#e8eaf0"
-                    card_border = "border:1px solid rgba(255,255,255,0.06);border-left:3px solid #ffa502;"
-            elif qtd_av > 0:
-                border_color = "#f97316"
-                card_bg = "linear-gradient(135deg, rgba(249,115,22,0.08), #1a1d2e)"
-                qty_color = "#f97316"
-                card_border = "border:1px solid rgba(255,255,255,0.06);border-left:3px solid #f97316;"
-            elif diff == 0:
-                border_color = "#22c55e"
-                card_bg = "#1a1d2e"
-                qty_color = "#e8eaf0"
-                card_border = "border:1px solid rgba(255,255,255,0.06);border-left:3px solid #22c55e;"
-            elif diff < 0:
-                border_color = "#ef4444"
-                card_bg = "linear-gradient(135deg, rgba(239,68,68,0.28), rgba(180,20,20,0.18))"
-                qty_color = "#ffffff"
-                card_border = "border:2px solid rgba(239,68,68,0.7);"
+                    palette = _TM_COL_CICLO_PENDENTE
             else:
-                border_color = "#06b6d4"
-                card_bg = "linear-gradient(135deg, rgba(6,182,212,0.28), rgba(0,100,140,0.18))"
-                qty_color = "#ffffff"
-                card_border = "border:2px solid rgba(6,182,212,0.7);"
+                palette = _TM_PALETAS_DIV[_pal_idx[i]]
+            border_color, card_bg, qty_color, card_border = palette
 
             # Category badge (ou código do produto no modo cíclico)
             cat_upper = str(r["categoria"]).strip().upper()
-            cat_bg_c, cat_fg_c = _CAT_STYLES.get(cat_upper, _CAT_DEFAULT)
             if color_mode == "ciclico":
-                cat_badge = (
-                    f'<div style="display:inline-flex;align-items:center;gap:5px;'
-                    f'font-size:11px;font-family:\'JetBrains Mono\',monospace;font-weight:600;'
-                    f'padding:3px 8px;border-radius:6px;'
-                    f'background:rgba(255,255,255,0.07);color:#e8eaf0;margin-bottom:10px;flex-shrink:0;">'
-                    f'<span style="width:6px;height:6px;border-radius:50%;background:{border_color};flex-shrink:0;"></span>'
-                    f'{cod_str}</div>'
-                )
+                cat_badge = _TM_BADGE_CICLO_TMPL % (border_color, cod_str)
             else:
-                cat_badge = (
-                    f'<div style="display:inline-flex;align-items:center;gap:5px;'
-                    f'font-size:9px;text-transform:uppercase;letter-spacing:1.2px;'
-                    f'font-weight:600;padding:3px 8px;border-radius:6px;'
-                    f'background:{cat_bg_c};color:{cat_fg_c};margin-bottom:10px;flex-shrink:0;">'
-                    f'<span style="width:6px;height:6px;border-radius:50%;background:{border_color};flex-shrink:0;"></span>'
-                    f'{cat_upper}</div>'
-                )
+                cat_bg_c, cat_fg_c = _TM_CAT_STYLES.get(cat_upper, _TM_CAT_DEFAULT)
+                cat_badge = _TM_BADGE_CAT_TMPL % (cat_bg_c, cat_fg_c, border_color, cat_upper)
 
             # Diff / avaria badge (top-right)
             if qtd_av > 0:
-                badge_html = (
-                    f'<div style="position:absolute;top:10px;right:10px;'
-                    f'font-size:10px;font-weight:600;font-family:\'JetBrains Mono\',monospace;'
-                    f'padding:2px 7px;border-radius:6px;'
-                    f'background:rgba(249,115,22,0.12);color:#f97316;">⚠ {qtd_av} av.</div>'
-                )
+                badge_html = _TM_AVARIA_BADGE_TMPL % (qtd_av,)
             elif diff != 0:
-                sign = "▲" if diff > 0 else "▼"
-                bdg_bg = "rgba(255,255,255,0.18)"
-                bdg_fg = "#ffffff"
-                badge_html = (
-                    f'<div style="position:absolute;top:10px;right:10px;'
-                    f'font-size:10px;font-weight:600;font-family:\'JetBrains Mono\',monospace;'
-                    f'padding:2px 7px;border-radius:6px;'
-                    f'background:{bdg_bg};color:{bdg_fg};">{sign}{abs(diff)}</div>'
-                )
+                badge_html = _TM_DIFF_BADGE_TMPL % ("▲" if diff > 0 else "▼", abs(diff))
             else:
                 badge_html = ""
 
@@ -7628,12 +7812,7 @@ def build_css_treemap(df: pd.DataFrame, filter_cat: str = "TODOS", avarias_map:
                 if _status_c in ("ok", "divergencia"):
                     _contado = str(r.get("contado_ciclo_em", "") or "").strip()
                     if _contado and _contado.lower() != "none" and len(_contado) >= 10:
-                        _data_fmt = f"{_contado[8:10]}/{_contado[5:7]}"
-                        ciclo_date_html = (
-                            f'<div style="margin-top:6px;font-size:10px;font-weight:600;'
-                            f'font-family:\'JetBrains Mono\',monospace;letter-spacing:0.3px;'
-                            f'color:rgba(255,255,255,0.92);">📅 {_data_fmt}</div>'
-                        )
+                        ciclo_date_html = _TM_CICLO_DATE_TMPL % (f"{_contado[8:10]}/{_contado[5:7]}",)
 
             # Cooperado(s) com divergência para exibir no popup CSS do card
             cooperado_popup_html = ""
@@ -7649,11 +7828,7 @@ def build_css_treemap(df: pd.DataFrame, filter_cat: str = "TODOS", avarias_map:
                     _coops.append((_coop, _qtd, _sinal))
                 if _coops:
                     _coops_txt = ", ".join(f"{_n} ({_s}{_q})" for _n, _q, _s in _coops)
-                    cooperado_popup_html = (
-                        f'<div style="font-size:0.82rem;font-weight:600;color:#e2e8f0;margin-top:6px;'
-                        f'border-top:1px solid rgba(255,255,255,0.12);padding-top:6px;">'
-                        f'&#x1F464; {_coops_txt}</div>'
-                    )
+                    cooperado_popup_html = _TM_COOP_POPUP_TMPL % (_coops_txt,)
 
             # Último comentário do app sincronizado (inventario_cicli.observacao)
             obs_popup_html = ""
@@ -7663,41 +7838,24 @@ def build_css_treemap(df: pd.DataFrame, filter_cat: str = "TODOS", avarias_map:
                 _obs_dt = str(_obs_dt or "").strip()
                 _obs_dt_fmt = f"{_obs_dt[8:10]}/{_obs_dt[5:7]}" if len(_obs_dt) >= 10 else ""
                 if _obs_txt:
-                    obs_popup_html = (
-                        f'<div style="font-size:0.78rem;font-weight:500;color:#cbd5e1;margin-top:6px;'
-                        f'border-top:1px solid rgba(255,255,255,0.12);padding-top:6px;">'
-                        f'&#x1F4AC; {_obs_txt}'
-                        + (f' <span style="color:#94a3b8;">&middot; {_obs_dt_fmt}</span>' if _obs_dt_fmt else '')
-                        + '</div>'
+                    obs_popup_html = _TM_OBS_POPUP_TMPL % (
+                        _obs_txt, _TM_OBS_DATE_TMPL % (_obs_dt_fmt,) if _obs_dt_fmt else "",
                     )
 
-            prods.append(
-                f'<div class="tm-tile{blink_cls}" tabindex="0" title="{r["codigo"]} — {r["produto"]}"'
-                f' data-codigo="{cod_str}"'
-                f'{ctx_attr}'
-                f' style="background:{card_bg};{card_border}'
-                f'border-radius:12px;padding:14px;position:relative;{opacity_style}">'
-                f'{cat_badge}'
-                f'{badge_html}'
-                f'<div class="tm-name">{short_name(r["produto"])}</div>'
-                f'<div class="tm-info" style="color:{qty_color};">{info}</div>'
-                f'{venc_label_html}'
-                f'{ciclo_date_html}'
-                f'<div class="tm-cod">{r["codigo"]}</div>'
-                f'<div class="tm-popup"><div class="tm-popup-code">{r["codigo"]}</div>{r["produto"]}{cooperado_popup_html}{obs_popup_html}</div>'
-                f'</div>'
-            )
+            parts.append(_TM_TILE_TMPL % (
+                blink_cls, r["codigo"], r["produto"], cod_str, ctx_attr,
+                card_bg, card_border, opacity_style,
+                cat_badge, badge_html,
+                short_name(r["produto"]), qty_color, info,
+                venc_label_html, ciclo_date_html,
+                r["codigo"], r["codigo"], r["produto"],
+                cooperado_popup_html, obs_popup_html,
+            ))
 
-        parts.append(
-            f'<div style="width:100%;background:#111827;border-radius:8px;padding:8px;'
-            f'margin-bottom:8px;border:1px solid #1e293b;">'
-            f'<div style="font-size:0.75rem;color:#64748b;font-weight:700;text-transform:uppercase;'
-            f'margin-bottom:6px;border-bottom:1px solid #1e293b;padding-bottom:4px;">'
-            f'{cat} <span style="font-size:0.6rem;color:#4a5568;font-weight:400;">({len(rows)})</span></div>'
-            f'<div class="tm-wrap">{"".join(prods)}</div></div>'
-        )
+        parts.append(_TM_CAT_TAIL)
 
-    return f'<div style="display:flex;flex-direction:column;min-height:450px;">{"".join(parts)}</div>'
+    parts.append(_TM_WRAP_TAIL)
+    return "".join(parts)
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -7717,24 +7875,21 @@ def save_vendas_historico(records: list, grupo_map: dict, zerados: list = None,
 
         if is_mestre:
             conn.execute("DELETE FROM vendas_historico")
-            rows = []
-            for r in records:
-                rows.append((r["codigo"], r["produto"],
-                             r.get("categoria", "OUTROS"),
-                             r.get("qtd_vendida", 0),
-                             r.get("qtd_sistema", 0), hoje))
-            if zerados:
-                for z in zerados:
-                    if isinstance(z, dict):
-                        rows.append((z["codigo"], z["produto"],
-                                     z.get("grupo", "OUTROS"),
-                                     z.get("qtd_vendida", 0), 0, hoje))
-            if rows:
-                conn.executemany("""
-                    INSERT INTO vendas_historico
-                        (codigo, produto, grupo, qtd_vendida, qtd_estoque, data_upload)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, rows)
+            # Geradores encadeados: as linhas vão para o INSERT em lote chunk a chunk,
+            # sem materializar uma 2ª lista do tamanho de records
+            rows = chain(
+                ((r["codigo"], r["produto"],
+                  r.get("categoria", "OUTROS"),
+                  r.get("qtd_vendida", 0),
+                  r.get("qtd_sistema", 0), hoje)
+                 for r in records),
+                ((z["codigo"], z["produto"],
+                  z.get("grupo", "OUTROS"),
+                  z.get("qtd_vendida", 0), 0, hoje)
+                 for z in (zerados or []) if isinstance(z, dict)),
+            )
+            _insert_many(conn, "vendas_historico",
+                         ["codigo", "produto", "grupo", "qtd_vendida", "qtd_estoque", "data_upload"], rows)
         else:
             # ── PARCIAL: substitui dia a dia ─────────────────────────────
             # Descobre quais códigos já têm registro HOJE
@@ -7764,18 +7919,9 @@ def save_vendas_historico(records: list, grupo_map: dict, zerados: list = None,
                     codigos_hoje.add(cod)   # evita duplicar na mesma chamada
 
             if updates:
-                conn.executemany("""
-                    UPDATE vendas_historico
-                       SET qtd_vendida = ?,
-                           qtd_estoque = ?
-                     WHERE codigo = ? AND data_upload = ?
-                """, updates)
+                conn.executemany(_SQL_UPDATE_VH_DIA, updates)
             if inserts:
-                conn.executemany("""
-                    INSERT INTO vendas_historico
-                        (codigo, produto, grupo, qtd_vendida, qtd_estoque, data_upload)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, inserts)
+                conn.executemany(_SQL_INSERT_VH, inserts)
 
         conn.commit()
         if do_sync:
@@ -8966,6 +9112,16 @@ _DEFAULT_LEGEND = dict(
     font=dict(size=10, color="#94a3b8"),
 )
 
+# Layout fixo do scatter Vendido × Estoque (aba de vendas) — montado uma vez
+_SCATTER_VENDIDO_ESTOQUE_LAYOUT = dict(
+    _PLOTLY_LAYOUT,
+    title=dict(text="Vendido × Estoque (abaixo da linha = estoque menor que vendas)", font=dict(size=12, color="#94a3b8")),
+    height=380,
+    xaxis=dict(title="Qtd Vendida", gridcolor="#1e293b"),
+    yaxis=dict(title="Qtd Estoque", gridcolor="#1e293b"),
+    legend=dict(font=dict(size=8), orientation="h", y=-0.2),
+)
+
 _GROUP_COLORS = {
     "HERBICIDAS": "#3b82f6", "INSETICIDAS": "#00d68f",
     "ADUBOS FOLIARES": "#a55eea", "ADUBOS QUÍMICOS": "#8b5cf6",
@@ -8982,6 +9138,25 @@ def _get_color(grupo: str) -> str:
     return _GROUP_COLORS.get(grupo, "#64748b")
 
 
+# Palavras de categoria ignoradas no início do nome ao comparar produtos equivalentes
+_PREFIXOS_CATEGORIA = frozenset({
+    "HERBICIDA", "FUNGICIDA", "INSETICIDA", "ACARICIDA", "NEMATICIDA",
+    "ADJUVANTE", "FERTILIZANTE", "REGULADOR", "ESTIMULANTE", "INOCULANTE",
+    "SEMENTE", "SEM", "BIOLOGICO", "BIOLÓGICO", "ADUBO", "DEFENSIVO",
+    "MICRONUTRIENTE", "ENXOFRE", "CALCARIO", "CALCÁRIO",
+})
+
+
+@functools.lru_cache(maxsize=8192)
+def _core_nome(nome: str) -> str:
+    """Nome do produto sem os prefixos de categoria — memoizado (o mestre se repete entre chamadas)."""
+    palavras = nome.upper().strip().split()
+    i = 0
+    while i < len(palavras) and palavras[i] in _PREFIXOS_CATEGORIA:
+        i += 1
+    return " ".join(palavras[i:])
+
+
 def _build_df_zerados(df_vendas: pd.DataFrame) -> pd.DataFrame:
     """Retorna DataFrame com produtos zerados que venderam, sem duplicatas por nome equivalente."""
     df_zero = df_vendas[
@@ -8993,19 +9168,6 @@ def _build_df_zerados(df_vendas: pd.DataFrame) -> pd.DataFrame:
 
     # Remover duplicatas: produtos zerados que têm equivalente com estoque
     # (mesmo produto cadastrado com código diferente que ainda tem estoque)
-    _PREFIXOS_CATEGORIA = {
-        "HERBICIDA", "FUNGICIDA", "INSETICIDA", "ACARICIDA", "NEMATICIDA",
-        "ADJUVANTE", "FERTILIZANTE", "REGULADOR", "ESTIMULANTE", "INOCULANTE",
-        "SEMENTE", "SEM", "BIOLOGICO", "BIOLÓGICO", "ADUBO", "DEFENSIVO",
-        "MICRONUTRIENTE", "ENXOFRE", "CALCARIO", "CALCÁRIO",
-    }
-
-    def _core_nome(nome: str) -> str:
-        palavras = nome.upper().strip().split()
-        while palavras and palavras[0] in _PREFIXOS_CATEGORIA:
-            palavras = palavras[1:]
-        return " ".join(palavras)
-
     try:
         _em_rows = get_db().execute(
             "SELECT produto FROM estoque_mestre WHERE qtd_sistema > 0"
@@ -9030,17 +9192,16 @@ def _build_df_zerados(df_vendas: pd.DataFrame) -> pd.DataFrame:
     return df_zero
 
 
-def build_vendas_tab(df_vendas: pd.DataFrame):
-    """Renderiza a aba completa de gráficos de vendas."""
-    if df_vendas.empty:
-        st.info("📊 Nenhum dado de vendas carregado ainda. Faça upload de uma planilha de vendas para ativar os gráficos.")
-        return
-
-    _periodo_vendas = get_periodo_vendas()
-
-    # ── Converter lonas com dimensões de m² → unidades antes de agregar ──
-    df_vendas = df_vendas.copy()
-
+@st.cache_data(ttl=1800)
+def get_vendas_por_grupo(df_vendas: pd.DataFrame) -> tuple:
+    """Converte lonas de m² → unidades e agrega por grupo.
+
+    Retorna (df_vendas convertido, df_grupo). Cacheado pelo conteúdo de
+    df_vendas: a aba de vendas re-renderiza a cada rerun e o apply por linha
+    + groupby só precisam rodar quando os dados mudam. A agregação fica em
+    pandas (e não num GROUP BY no banco) porque a conversão das lonas é por
+    produto e precisa vir antes da soma.
+    """
     def _conv_lona(r):
         if r["grupo"] == "LONAS":
             m = _RE_LONA_DIM.search(str(r["produto"]))
@@ -9051,19 +9212,62 @@ def build_vendas_tab(df_vendas: pd.DataFrame):
                     return max(1, round(r["qtd_vendida"] / area))
         return r["qtd_vendida"]
 
-    df_vendas["qtd_vendida"] = df_vendas.apply(_conv_lona, axis=1)
+    # assign devolve frame novo: não mexe no df cacheado do chamador, sem .copy() extra
+    df_vendas = df_vendas.assign(qtd_vendida=df_vendas.apply(_conv_lona, axis=1))
 
-    # ── Dados agregados por grupo ────────────────────────────────────────
     df_grupo = df_vendas.groupby("grupo", as_index=False).agg(
         qtd_vendida=("qtd_vendida", "sum"),
         qtd_estoque=("qtd_estoque", "sum"),
         produtos=("codigo", "nunique"),
     ).sort_values("qtd_vendida", ascending=False)
+    return df_vendas, df_grupo
+
+
+@st.cache_data(ttl=1800, max_entries=16)
+def _fig_vendido_estoque(df_prod: pd.DataFrame) -> go.Figure:
+    """Scatter Vendido × Estoque da aba de vendas, cacheado pelo conteúdo de df_prod.
+
+    O filtro de grupo não muda entre a maioria dos reruns; com o mesmo
+    df_prod a figura volta pronta do cache e só o st.plotly_chart reenvia.
+    """
+    fig_scatter = go.Figure()
+    for g in df_prod["grupo"].unique():
+        dg = df_prod[df_prod["grupo"] == g]
+        fig_scatter.add_trace(go.Scatter(
+            x=dg["qtd_vendida"], y=dg["qtd_estoque"],
+            mode="markers", name=g[:15],
+            marker=dict(
+                color=_get_color(g), size=8, opacity=0.7,
+                line=dict(width=1, color="#0a0f1a"),
+            ),
+            hovertemplate="<b>%{text}</b><br>Vendido: %{x}<br>Estoque: %{y}<extra></extra>",
+            text=df_prod.loc[dg.index, "produto"].apply(lambda p: p[:30]),
+        ))
+    # Linha de equilíbrio
+    max_val = max(df_prod["qtd_vendida"].max(), df_prod["qtd_estoque"].max(), 100)
+    fig_scatter.add_trace(go.Scatter(
+        x=[0, max_val], y=[0, max_val],
+        mode="lines", line=dict(dash="dash", color="#64748b", width=1),
+        name="Equilíbrio", showlegend=True,
+    ))
+    fig_scatter.update_layout(_SCATTER_VENDIDO_ESTOQUE_LAYOUT)
+    return fig_scatter
+
+
+def build_vendas_tab(df_vendas: pd.DataFrame):
+    """Renderiza a aba completa de gráficos de vendas."""
+    if df_vendas.empty:
+        st.info("📊 Nenhum dado de vendas carregado ainda. Faça upload de uma planilha de vendas para ativar os gráficos.")
+        return
+
+    _periodo_vendas = get_periodo_vendas()
+
+    df_vendas, df_grupo = get_vendas_por_grupo(df_vendas)
 
     total_vendido = int(df_grupo["qtd_vendida"].sum())
     total_estoque = int(df_grupo["qtd_estoque"].sum())
-    total_skus = int(df_vendas["codigo"].nunique())
-    n_zerados = int((df_vendas["qtd_estoque"] <= 0).sum())
+    total_skus = len(pd.unique(df_vendas["codigo"].to_numpy()))
+    n_zerados = int(np.count_nonzero(df_vendas["qtd_estoque"].to_numpy() <= 0))
     pct_ruptura = round((n_zerados / max(total_skus, 1)) * 100)
 
     # ── KPIs ─────────────────────────────────────────────────────────────
@@ -9164,9 +9368,8 @@ def build_vendas_tab(df_vendas: pd.DataFrame):
             (df_vendas["qtd_estoque"] > 0) &
             (df_vendas["qtd_estoque"] < df_vendas["qtd_vendida"] * 0.5) &
             (df_vendas["qtd_vendida"] > 10)
-        ].copy()
+        ].assign(dias_cobertura=lambda d: d["qtd_estoque"] / (d["qtd_vendida"] / 30))
         # Ordenar por dias de cobertura (menor = mais urgente)
-        df_crit["dias_cobertura"] = df_crit["qtd_estoque"] / (df_crit["qtd_vendida"] / 30)
         df_crit = df_crit.sort_values("dias_cobertura", ascending=True)
 
         kc1, kc2, kc3 = st.columns(3)
@@ -9182,10 +9385,12 @@ def build_vendas_tab(df_vendas: pd.DataFrame):
             <div class="stat-label">⚡ Total Alertas</div></div>""", unsafe_allow_html=True)
 
         # Combinar e mostrar top 25 ordenado por estoque restante (menor = mais urgente)
-        df_alerta = pd.concat([
-            df_zero.head(15).assign(nivel="ZERADO", dias_cobertura=0.0),
-            df_crit.head(15).assign(nivel="CRÍTICO"),
-        ]).sort_values(
+        # 1 concat e o nível por posição (zerados vêm primeiro), sem .assign() por frame
+        _top_zero, _top_crit = df_zero.head(15), df_crit.head(15)
+        df_alerta = pd.concat([_top_zero, _top_crit])
+        df_alerta["nivel"] = np.repeat(["ZERADO", "CRÍTICO"], [len(_top_zero), len(_top_crit)])
+        df_alerta["dias_cobertura"] = df_alerta["dias_cobertura"].fillna(0.0)
+        df_alerta = df_alerta.sort_values(
             ["qtd_estoque", "qtd_vendida"],
             ascending=[True, False],  # menor estoque primeiro; desempate por maior venda
         ).head(25)
@@ -9217,8 +9422,8 @@ def build_vendas_tab(df_vendas: pd.DataFrame):
 
             # Tabela detalhada
             with st.expander("📋 Tabela Detalhada — Críticos", expanded=False):
-                df_show = df_alerta[["codigo", "produto", "grupo", "qtd_vendida", "qtd_estoque", "nivel"]].copy()
-                df_show.columns = ["Código", "Produto", "Grupo", "Vendido", "Estoque", "Nível"]
+                df_show = df_alerta[["codigo", "produto", "grupo", "qtd_vendida", "qtd_estoque", "nivel"]].set_axis(
+                    ["Código", "Produto", "Grupo", "Vendido", "Estoque", "Nível"], axis=1)
                 st.dataframe(df_show, hide_index=True, use_container_width=True)
         else:
             st.success("Nenhum produto em situação crítica! 🎉")
@@ -9226,9 +9431,8 @@ def build_vendas_tab(df_vendas: pd.DataFrame):
         # Lista completa de zerados
         if not df_zero.empty:
             with st.expander(f"💀 Lista Completa — Estoque Zerado ({len(df_zero)} produtos)", expanded=False):
-                df_zero_show = df_zero[["codigo", "produto", "grupo", "qtd_vendida"]].copy()
-                df_zero_show.columns = ["Código", "Produto", "Grupo", "Vendido"]
-                df_zero_show = df_zero_show.reset_index(drop=True)
+                df_zero_show = df_zero[["codigo", "produto", "grupo", "qtd_vendida"]].set_axis(
+                    ["Código", "Produto", "Grupo", "Vendido"], axis=1).reset_index(drop=True)
                 st.dataframe(df_zero_show, hide_index=True, use_container_width=True, height=400)
 
     # ══════════════════════════════════════════════════════════════════════
@@ -9237,9 +9441,9 @@ def build_vendas_tab(df_vendas: pd.DataFrame):
     with vt3:
         st.caption(f"Estimativa de dias até zerar estoque no ritmo atual (baseado nos últimos **{_periodo_vendas} dia{'s' if _periodo_vendas != 1 else ''}** de vendas acumuladas)")
 
-        df_burn = df_grupo[df_grupo["qtd_vendida"] > 0].copy()
-        df_burn["dias_estoque"] = (df_burn["qtd_estoque"] / df_burn["qtd_vendida"] * _periodo_vendas).round(0).astype(int)
-        df_burn = df_burn.sort_values("dias_estoque").head(12)
+        df_burn = df_grupo.loc[df_grupo["qtd_vendida"] > 0].assign(
+            dias_estoque=lambda d: (d["qtd_estoque"] / d["qtd_vendida"] * _periodo_vendas).round(0).astype(int)
+        ).sort_values("dias_estoque").head(12)
 
         if not df_burn.empty:
             colors_burn = [
@@ -9290,15 +9494,16 @@ def build_vendas_tab(df_vendas: pd.DataFrame):
     # ══════════════════════════════════════════════════════════════════════
     # TAB 4 — TOP PRODUTOS
     # ══════════════════════════════════════════════════════════════════════
-    with vt4:
+    # Fragmento: trocar o filtro de grupo reroda só esta aba, não o app inteiro
+    @st.fragment
+    def _aba_top_produtos():
         col_filter, _ = st.columns([1, 2])
         with col_filter:
             grupos_disp = ["TODOS"] + sorted(df_vendas["grupo"].unique().tolist())
             grupo_sel = st.selectbox("Filtrar por grupo:", grupos_disp, key="vendas_filtro_grupo")
 
-        df_prod = df_vendas.copy()
-        if grupo_sel != "TODOS":
-            df_prod = df_prod[df_prod["grupo"] == grupo_sel]
+        # Só leitura daqui pra baixo: filtro direto, sem cópia defensiva
+        df_prod = df_vendas if grupo_sel == "TODOS" else df_vendas[df_vendas["grupo"] == grupo_sel]
 
         df_top_prod = df_prod.nlargest(15, "qtd_vendida").reset_index(drop=True)
 
@@ -9326,38 +9531,14 @@ def build_vendas_tab(df_vendas: pd.DataFrame):
             st.plotly_chart(fig_top, use_container_width=True, config={"displayModeBar": False, "editable": False, "scrollZoom": False})
 
             # Scatter vendido vs estoque
-            fig_scatter = go.Figure()
-            for g in df_prod["grupo"].unique():
-                dg = df_prod[df_prod["grupo"] == g]
-                fig_scatter.add_trace(go.Scatter(
-                    x=dg["qtd_vendida"], y=dg["qtd_estoque"],
-                    mode="markers", name=g[:15],
-                    marker=dict(
-                        color=_get_color(g), size=8, opacity=0.7,
-                        line=dict(width=1, color="#0a0f1a"),
-                    ),
-                    hovertemplate="<b>%{text}</b><br>Vendido: %{x}<br>Estoque: %{y}<extra></extra>",
-                    text=df_prod.loc[dg.index, "produto"].apply(lambda p: p[:30]),
-                ))
-            # Linha de equilíbrio
-            max_val = max(df_prod["qtd_vendida"].max(), df_prod["qtd_estoque"].max(), 100)
-            fig_scatter.add_trace(go.Scatter(
-                x=[0, max_val], y=[0, max_val],
-                mode="lines", line=dict(dash="dash", color="#64748b", width=1),
-                name="Equilíbrio", showlegend=True,
-            ))
-            fig_scatter.update_layout(
-                **_PLOTLY_LAYOUT,
-                title=dict(text="Vendido × Estoque (abaixo da linha = estoque menor que vendas)", font=dict(size=12, color="#94a3b8")),
-                height=380,
-                xaxis=dict(title="Qtd Vendida", gridcolor="#1e293b"),
-                yaxis=dict(title="Qtd Estoque", gridcolor="#1e293b"),
-                legend=dict(font=dict(size=8), orientation="h", y=-0.2),
-            )
+            fig_scatter = _fig_vendido_estoque(df_prod)
             st.plotly_chart(fig_scatter, use_container_width=True, config={"displayModeBar": False, "editable": False, "scrollZoom": False})
         else:
             st.info("Nenhum produto encontrado para o filtro selecionado.")
 
+    with vt4:
+        _aba_top_produtos()
+
     # ══════════════════════════════════════════════════════════════════════
     # TAB 5 — PRODUTOS ESQUECIDOS (sem movimentação)
     # ══════════════════════════════════════════════════════════════════════
@@ -9903,37 +10084,6 @@ def build_infograficos_tab():
 # MAIN APP
 # ══════════════════════════════════════════════════════════════════════════════
 
-# ── Header banner + clima ──────────────────────────────────────────────────
-_wd_dash = get_weather_forecast_quirinopolis()
-_now_dash = datetime.now(tz=_BRT)
-_dia_abr_dash = ["Seg","Ter","Qua","Qui","Sex","Sáb","Dom"][_now_dash.weekday()]
-_hora_dash = _now_dash.strftime("%H:%M")
-
-if _wd_dash:
-    _cur_d = _wd_dash["current"]
-    _wtemp_d = round(_cur_d["temperature_2m"])
-    _wcode_d = int(_cur_d["weathercode"])
-    _humid_d = round(_cur_d.get("relative_humidity_2m", 0))
-    _vento_d = round(_cur_d.get("wind_speed_10m", 0))
-    _c = _wcode_d
-    if _c == 0:                      _wemoji_d, _wdesc_d = "☀️", "Céu limpo"
-    elif _c in (1,2):                _wemoji_d, _wdesc_d = "🌤️", "Poucas nuvens"
-    elif _c == 3:                    _wemoji_d, _wdesc_d = "☁️", "Nublado"
-    elif _c in (45,48):              _wemoji_d, _wdesc_d = "🌫️", "Névoa"
-    elif _c in (51,53,55):           _wemoji_d, _wdesc_d = "🌦️", "Chuvisco"
-    elif _c in (61,63,65,80,81,82):  _wemoji_d, _wdesc_d = "🌧️", "Chuva"
-    elif _c in (95,96,99):           _wemoji_d, _wdesc_d = "⛈️", "Tempestade"
-    elif _c in (71,73,75,77):        _wemoji_d, _wdesc_d = "❄️", "Neve"
-    else:                            _wemoji_d, _wdesc_d = "🌡️", ""
-    _whtml = f"""<div class="wco" style="text-align:center;background:rgba(17,24,39,0.85);backdrop-filter:blur(8px);">
-  <div style="font-size:1.6rem;line-height:1;">{_wemoji_d}</div>
-  <div style="font-size:1.3rem;font-weight:700;line-height:1.2;letter-spacing:-0.5px;color:#fff;margin-top:3px;">{_wtemp_d}°</div>
-  <div style="font-size:0.6rem;color:rgba(255,255,255,0.6);margin-top:2px;">{_wdesc_d}</div>
-  <div style="font-size:0.55rem;color:rgba(255,255,255,0.4);margin-top:1px;">Quirinópolis</div>
-</div>"""
-else:
-    _whtml = ""
-
 # ── Alertas automáticos (computados aqui, renderizados abaixo da busca) ──────
 if (
     "alertas_reg_date" not in st.session_state
@@ -9977,13 +10127,10 @@ stock_count = get_stock_count()
 has_mestre = stock_count > 0
 
 # ── Header CAMDA compacto (sticky, só no dashboard, após autenticação) ──────
-def apply_header_css() -> None:
-    """CSS do header compacto e da busca integrada — bloco único.
-
-    Todo o CSS novo do topo fica centralizado aqui para não espalhar
-    st.markdown pelo código.
-    """
-    st.markdown("""
+# CSS do header compacto e da busca integrada — bloco único.
+# Todo o CSS novo do topo fica centralizado aqui para não espalhar
+# st.markdown pelo código; vai junto com o HTML em render_camda_header.
+_HEADER_CSS = """
 <style>
 @import url('https://fonts.googleapis.com/css2?family=Sora:wght@600;700&family=Inter:wght@400;500;600&family=JetBrains+Mono:wght@500;600&display=swap');
 :root {
@@ -10156,14 +10303,17 @@ div.st-key-search_mestre [data-testid="stTextInput"] input:focus {
     }
 }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 
 def render_camda_header(total_itens=None, n_diverg_dia=None) -> None:
-    """Renderiza o header compacto de 54px (marca · busca · resumo operacional)."""
+    """Renderiza o header compacto de 54px (marca · busca · resumo operacional).
+
+    CSS e HTML saem num único st.markdown.
+    """
     total_txt = f"{total_itens:,}".replace(",", ".") if isinstance(total_itens, int) else "—"
     div_txt = str(n_diverg_dia) if isinstance(n_diverg_dia, int) else "—"
-    st.markdown(f"""
+    st.markdown(_HEADER_CSS + f"""
 <div class="camda-topbar">
   <div class="ct-brand">
     <svg class="ct-hex" width="34" height="34" viewBox="0 0 100 100" aria-hidden="true">
@@ -10192,8 +10342,6 @@ def render_camda_header(total_itens=None, n_diverg_dia=None) -> None:
 """, unsafe_allow_html=True)
 
 
-apply_header_css()
-
 # ── Dados dinâmicos do header ────────────────────────────────────────────────
 # Divergências registradas hoje (criado_em = '%Y-%m-%d %H:%M:%S' em BRT)
 _df_divs_hdr = get_divergencias()
@@ -11770,6 +11918,7 @@ new Chart(document.getElementById('coop-chart'),{
                 if foto_b64:
                     st.markdown(
                         f'<img src="data:image/jpeg;base64,{foto_b64}" '
+                        f'decoding="async" '
                         f'style="width:100%;border-radius:12px;display:block;" '
                         f'alt="Via cega do pedido">',
                         unsafe_allow_html=True
@@ -11984,6 +12133,7 @@ new Chart(document.getElementById('coop-chart'),{
                             f'overflow:hidden;border:1px solid rgba(100,180,255,0.2);'
                             f'flex-shrink:0;background:rgba(0,0,0,0.25);cursor:zoom-in;">'
                             f'<img src="data:image/jpeg;base64,{f["foto_base64"]}" '
+                            f'decoding="async" '
                             f'style="width:80px;height:80px;object-fit:cover;pointer-events:none;">'
                             f'<div style="font-size:8px;color:rgba(100,180,255,0.5);padding:3px 0;'
                             f'letter-spacing:0.5px;font-family:monospace;pointer-events:none;">'
@@ -14448,7 +14598,7 @@ with st.expander("📤 Upload de Planilha", expanded=not has_mestre):
             if st.session_state.processed_file != file_id:
                 if is_parcial_estoque:
                     try:
-                        df_raw = pd.read_excel(uploaded, sheet_name=0, header=None)
+                        df_raw = _read_planilha_raw(uploaded)
                         ok, result = parse_parcial_estoque(df_raw)
                         zerados = []
                     except Exception as e:
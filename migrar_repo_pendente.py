@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+migrar_repo_pendente.py — cria o índice único parcial ux_repo_pendente.
+
+Script AVULSO: não é importado pelo app e não deve ser. Roda em dry-run por
+padrão; só escreve com --apply.
+
+POR QUÊ
+-------
+O upload de vendas grava a reposição com um UPSERT multi-linha
+(ON CONFLICT(codigo) WHERE reposto = 0), que exige no máximo UMA pendência
+por código em reposicao_loja. O índice
+
+    CREATE UNIQUE INDEX ux_repo_pendente ON reposicao_loja(codigo) WHERE reposto = 0
+
+garante isso. Enquanto ele não existir, o app detecta a ausência
+(_supports_repo_upsert) e segue pelo caminho antigo — nada quebra.
+
+CONSOLIDAÇÃO
+------------
+Bancos antigos podem ter pendências duplicadas para o mesmo código, e aí o
+índice não pode ser criado. Antes dele, a migração soma qtd_vendida de todas
+as pendências do código na MAIS ANTIGA (menor id) e apaga as demais. Tudo
+(soma, exclusão e índice) roda numa única transação: qualquer falha desfaz
+o lote inteiro.
+
+USO
+---
+    python migrar_repo_pendente.py           # dry-run: lista as duplicatas
+    python migrar_repo_pendente.py --apply   # consolida + cria o índice
+
+Depois de aplicar, reinicie o app para ele passar a usar o UPSERT.
+Credenciais como em backfill_codigo_mapa.py.
+"""
+
+import argparse
+import sys
+
+from backfill_codigo_mapa import checar_tabelas, conectar
+
+_INDICE = "ux_repo_pendente"
+
+
+def indice_existe(conn) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (_INDICE,)
+    ).fetchone() is not None
+
+
+def listar_duplicatas(conn):
+    """(codigo, n_pendências, soma qtd_vendida) dos códigos com mais de uma pendência."""
+    return conn.execute("""
+        SELECT codigo, COUNT(*), SUM(qtd_vendida)
+          FROM reposicao_loja
+         WHERE reposto = 0
+         GROUP BY codigo
+        HAVING COUNT(*) > 1
+         ORDER BY codigo
+    """).fetchall()
+
+
+def aplicar(conn):
+    """Consolida as duplicatas e cria o índice numa transação só."""
+    try:
+        conn.execute("""
+            UPDATE reposicao_loja
+               SET qtd_vendida = (SELECT SUM(r2.qtd_vendida) FROM reposicao_loja r2
+                                   WHERE r2.codigo = reposicao_loja.codigo AND r2.reposto = 0)
+             WHERE reposto = 0 AND id IN (
+                 SELECT MIN(id) FROM reposicao_loja WHERE reposto = 0
+                  GROUP BY codigo HAVING COUNT(*) > 1)
+        """)
+        conn.execute("""
+            DELETE FROM reposicao_loja
+             WHERE reposto = 0 AND id NOT IN (
+                 SELECT MIN(id) FROM reposicao_loja WHERE reposto = 0 GROUP BY codigo)
+        """)
+        conn.execute(
+            f"CREATE UNIQUE INDEX {_INDICE} ON reposicao_loja(codigo) WHERE reposto = 0"
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    try:
+        conn.sync()
+    except Exception:
+        pass
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        description="Consolida pendências duplicadas da reposição e cria ux_repo_pendente.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    ap.add_argument("--apply", action="store_true",
+                    help="grava de fato (o padrão é dry-run)")
+    args = ap.parse_args(argv)
+
+    conn = conectar()
+    checar_tabelas(conn, ("reposicao_loja",))
+
+    if indice_existe(conn):
+        print(f"→ {_INDICE} já existe — nada a fazer.")
+        return 0
+
+    dups = listar_duplicatas(conn)
+    print(f"\n── Códigos com pendência duplicada: {len(dups)} ──")
+    for codigo, n, soma in dups:
+        print(f"  · {codigo}: {n} pendências → 1 (qtd_vendida = {soma})")
+
+    if not args.apply:
+        print(f"\nDRY-RUN: nada foi escrito → rode com --apply para consolidar "
+              f"e criar {_INDICE}.")
+        return 0
+
+    try:
+        aplicar(conn)
+    except Exception as e:
+        print(f"ERRO: migração desfeita (rollback): {e}", file=sys.stderr)
+        return 1
+    print(f"\n→ {len(dups)} código(s) consolidado(s); {_INDICE} criado. "
+          "Reinicie o app para usar o UPSERT.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""
+Carrega funções de app_turso.py sem importar o módulo.
+
+Importar app_turso executa a UI inteira e abre a conexão com o Turso, então os
+testes extraem via AST só as definições de topo que precisam (funções e
+constantes pelo nome; nome terminado em "*" vale como prefixo) e executam num
+namespace com os imports reais do app.
+"""
+
+import ast
+import functools
+import html as _esc_html
+import pathlib
+import re
+import types
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+_APP = pathlib.Path(__file__).resolve().parent.parent / "app_turso.py"
+
+
+def _nome(node):
+    if isinstance(node, ast.FunctionDef):
+        return node.name
+    if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+        return node.targets[0].id
+    if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+        return node.target.id
+    return None
+
+
+def carregar(nomes, extra=None) -> dict:
+    """Executa as definições `nomes` de app_turso.py e devolve o namespace."""
+    tree = ast.parse(_APP.read_text(encoding="utf-8"))
+    ns = dict(
+        st=st, pd=pd, np=np, re=re, types=types, functools=functools,
+        _esc_html=_esc_html, datetime=datetime, timedelta=timedelta,
+        date=date, timezone=timezone,
+    )
+    if extra:
+        ns.update(extra)
+
+    def _quer(n):
+        return n in nomes or any(p.endswith("*") and n.startswith(p[:-1]) for p in nomes)
+
+    body = [node for node in tree.body if (n := _nome(node)) is not None and _quer(n)]
+    exec(compile(ast.Module(body=body, type_ignores=[]), str(_APP), "exec"), ns)
+    return ns
@@ -0,0 +1,54 @@
+import warnings
+
+import pandas as pd
+import pytest
+
+from _app_loader import carregar
+
+_NOMES = [
+    "parse_vendas_format", "_find_header", "parse_annotation", "_RE_*",
+    "_VALORES_VAZIOS", "normalize_grupo", "_GRUPO_MAP", "classify_product",
+    "_CLASSIFY_RULES",
+]
+
+
+@pytest.fixture(scope="module")
+def parse():
+    return carregar(_NOMES)["parse_vendas_format"]
+
+
+@pytest.fixture
+def planilha():
+    # Layout do relatório de vendas: título solto, cabeçalho e o grupo só na
+    # 1ª linha de cada bloco (o resto vem vazio e é propagado por ffill).
+    return pd.DataFrame([
+        ["RELATÓRIO DE VENDAS", None, None, None, None],
+        ["GRUPO DE PRODUTO", "PRODUTO", "QTDD - VENDIDA", "QTDD ESTOQUE", "OBS"],
+        ["HERBICIDAS", "1001 - ROUNDUP 20L", 3, 10, None],
+        [None, "1002 - GLIFOSATO 5L", 0, 4, "falta 1"],
+        ["FUNGICIDAS", "1003 - FUNGICIDA X", 2, 0, None],
+        [None, "1004 - FUNGICIDA Y", 1, 6, None],
+    ], dtype=object)
+
+
+def test_grupo_propagado(parse, planilha):
+    ok, records, zerados = parse(planilha)
+    assert ok
+    grupos = {r["codigo"]: r["categoria"] for r in records}
+    assert grupos["1002"] == grupos["1001"]
+    assert grupos["1004"] != grupos["1001"]
+    assert [z["codigo"] for z in zerados] == ["1003"]
+
+
+@pytest.mark.parametrize("grupo_vazio", [False, True])
+def test_parse_sem_warnings(parse, planilha, grupo_vazio):
+    # Regressão: com a coluna de grupo toda vazia o ffill emitia FutureWarning
+    # de downcast no pandas 2.x.
+    if grupo_vazio:
+        planilha.iloc[2:, 0] = None
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        ok, records, _ = parse(planilha)
+    assert ok
+    if grupo_vazio:
+        assert all(r["categoria"] for r in records)
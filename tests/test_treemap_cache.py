@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from _app_loader import carregar
+
+_NOMES = [
+    "build_css_treemap", "_codigo_key", "short_name", "_SHORT_PREFIXES",
+    "sort_categorias", "CATEGORIA_PRIORITY", "_CAT_PRIORITY_MAP", "_TM_*",
+    "normalize_grupo", "_GRUPO_MAP", "classify_product", "_CLASSIFY_RULES",
+]
+
+
+def _ordem_alfabetica(cats):
+    return sorted(cats)
+
+
+def _ordem_inversa(cats):
+    return sorted(cats, reverse=True)
+
+
+@pytest.fixture(scope="module")
+def app():
+    return carregar(_NOMES, extra={"_ciclo_prevalece": lambda *a, **k: False})
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame([
+        {"codigo": "1001", "produto": "HERBICIDA ROUNDUP", "categoria": "HERBICIDAS",
+         "qtd_sistema": 10, "qtd_fisica": 10, "diferenca": 0},
+        {"codigo": "1002", "produto": "FUNGICIDA X", "categoria": "FUNGICIDAS",
+         "qtd_sistema": 5, "qtd_fisica": 3, "diferenca": -2},
+        {"codigo": "1003", "produto": "SEMENTE SOJA", "categoria": "SEMENTES",
+         "qtd_sistema": 7, "qtd_fisica": 7, "diferenca": 0},
+    ])
+
+
+def test_cache_aceita_sort_fn(app, df):
+    # Mesmo caminho do inventário cíclico (sort_fn=_sort_ciclo): sem
+    # hash_funcs o st.cache_data levanta UnhashableParamError aqui.
+    tm = app["build_css_treemap"]
+    tm.clear()
+    html = tm(df, color_mode="ciclico", sort_fn=_ordem_alfabetica)
+    assert html
+    assert tm(df, color_mode="ciclico", sort_fn=_ordem_alfabetica) == html
+
+
+def test_sort_fn_diferentes_nao_dividem_entrada(app, df):
+    tm = app["build_css_treemap"]
+    tm.clear()
+    a = tm(df, sort_fn=_ordem_alfabetica)
+    b = tm(df, sort_fn=_ordem_inversa)
+    assert a != b
+    assert a.index("FUNGICIDAS") < a.index("SEMENTES")
+    assert b.index("SEMENTES") < b.index("FUNGICIDAS")